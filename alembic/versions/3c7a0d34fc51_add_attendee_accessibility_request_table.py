@@ -0,0 +1,86 @@
+"""Add attendee accessibility request table
+
+Revision ID: 3c7a0d34fc51
+Revises: b29f7596cec6
+Create Date: 2026-10-18 14:12:41.502317
+
+"""
+
+
+# revision identifiers, used by Alembic.
+revision = '3c7a0d34fc51'
+down_revision = 'b29f7596cec6'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+import residue
+from uuid import uuid4
+
+
+
+try:
+    is_sqlite = op.get_context().dialect.name == 'sqlite'
+except Exception:
+    is_sqlite = False
+
+if is_sqlite:
+    op.get_context().connection.execute('PRAGMA foreign_keys=ON;')
+    utcnow_server_default = "(datetime('now', 'utc'))"
+else:
+    utcnow_server_default = "timezone('utc', current_timestamp)"
+
+def sqlite_column_reflect_listener(inspector, table, column_info):
+    """Adds parenthesis around SQLite datetime defaults for utcnow."""
+    if column_info['default'] == "datetime('now', 'utc')":
+        column_info['default'] = utcnow_server_default
+
+sqlite_reflect_kwargs = {
+    'listeners': [('column_reflect', sqlite_column_reflect_listener)]
+}
+
+# ===========================================================================
+# HOWTO: Handle alter statements in SQLite
+#
+# def upgrade():
+#     if is_sqlite:
+#         with op.batch_alter_table('table_name', reflect_kwargs=sqlite_reflect_kwargs) as batch_op:
+#             batch_op.alter_column('column_name', type_=sa.Unicode(), server_default='', nullable=False)
+#     else:
+#         op.alter_column('table_name', 'column_name', type_=sa.Unicode(), server_default='', nullable=False)
+#
+# ===========================================================================
+
+
+def upgrade():
+    op.create_table('attendee_accessibility_request',
+    sa.Column('id', residue.UUID(), nullable=False),
+    sa.Column('created', residue.UTCDateTime(), server_default=sa.text(utcnow_server_default), nullable=False),
+    sa.Column('last_updated', residue.UTCDateTime(), server_default=sa.text(utcnow_server_default), nullable=False),
+    sa.Column('external_id', sa.JSON(), server_default='{}', nullable=False),
+    sa.Column('last_synced', sa.JSON(), server_default='{}', nullable=False),
+    sa.Column('attendee_id', residue.UUID(), nullable=False),
+    sa.Column('service', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['attendee_id'], ['attendee.id'], name=op.f('fk_attendee_accessibility_request_attendee_id_attendee'), ondelete='cascade'),
+    sa.PrimaryKeyConstraint('id', name=op.f('pk_attendee_accessibility_request')),
+    sa.UniqueConstraint('attendee_id', 'service', name=op.f('uq_attendee_accessibility_request_attendee_id'))
+    )
+    op.create_index('ix_attendee_accessibility_request_service', 'attendee_accessibility_request', ['service', 'attendee_id'], unique=False)
+
+    # Backfill from the comma-separated accessibility_requests column, which stays the source of truth
+    attendee = sa.table('attendee', sa.column('id', residue.UUID()), sa.column('accessibility_requests', sa.Unicode()))
+    request = sa.table('attendee_accessibility_request', sa.column('id', residue.UUID()),
+                       sa.column('attendee_id', residue.UUID()), sa.column('service', sa.Integer()))
+    connection = op.get_bind()
+    rows = [{'id': str(uuid4()), 'attendee_id': attendee_id, 'service': int(service)}
+            for attendee_id, requests in connection.execute(
+                sa.select(attendee.c.id, attendee.c.accessibility_requests).where(attendee.c.accessibility_requests != ''))
+            for service in set(requests.split(',')) if service]
+    if rows:
+        op.bulk_insert(request, rows)
+
+
+def downgrade():
+    op.drop_index('ix_attendee_accessibility_request_service', table_name='attendee_accessibility_request')
+    op.drop_table('attendee_accessibility_request')
@@ -0,0 +1,60 @@
+"""Add partial index on unassigned badge numbers
+
+Revision ID: 5e1d7c09a4b3
+Revises: 3c7a0d34fc51
+Create Date: 2026-10-18 13:12:27.418203
+
+"""
+
+
+# revision identifiers, used by Alembic.
+revision = '5e1d7c09a4b3'
+down_revision = '3c7a0d34fc51'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+
+try:
+    is_sqlite = op.get_context().dialect.name == 'sqlite'
+except Exception:
+    is_sqlite = False
+
+if is_sqlite:
+    op.get_context().connection.execute('PRAGMA foreign_keys=ON;')
+    utcnow_server_default = "(datetime('now', 'utc'))"
+else:
+    utcnow_server_default = "timezone('utc', current_timestamp)"
+
+def sqlite_column_reflect_listener(inspector, table, column_info):
+    """Adds parenthesis around SQLite datetime defaults for utcnow."""
+    if column_info['default'] == "datetime('now', 'utc')":
+        column_info['default'] = utcnow_server_default
+
+sqlite_reflect_kwargs = {
+    'listeners': [('column_reflect', sqlite_column_reflect_listener)]
+}
+
+# ===========================================================================
+# HOWTO: Handle alter statements in SQLite
+#
+# def upgrade():
+#     if is_sqlite:
+#         with op.batch_alter_table('table_name', reflect_kwargs=sqlite_reflect_kwargs) as batch_op:
+#             batch_op.alter_column('column_name', type_=sa.Unicode(), server_default='', nullable=False)
+#     else:
+#         op.alter_column('table_name', 'column_name', type_=sa.Unicode(), server_default='', nullable=False)
+#
+# ===========================================================================
+
+
+def upgrade():
+    op.create_index('ix_badge_info_unassigned_ident', 'badge_info', ['ident'], unique=False,
+                    postgresql_where=sa.text('attendee_id IS NULL'), sqlite_where=sa.text('attendee_id IS NULL'))
+
+
+def downgrade():
+    op.drop_index('ix_badge_info_unassigned_ident', table_name='badge_info')
@@ -0,0 +1,62 @@
+"""Add index on attendee registered
+
+Revision ID: 7a4f2c93e1d5
+Revises: d84b2e61f0c7
+Create Date: 2026-10-18 16:41:09.227310
+
+"""
+
+
+# revision identifiers, used by Alembic.
+revision = '7a4f2c93e1d5'
+down_revision = 'd84b2e61f0c7'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+
+try:
+    is_sqlite = op.get_context().dialect.name == 'sqlite'
+except Exception:
+    is_sqlite = False
+
+if is_sqlite:
+    op.get_context().connection.execute('PRAGMA foreign_keys=ON;')
+    utcnow_server_default = "(datetime('now', 'utc'))"
+else:
+    utcnow_server_default = "timezone('utc', current_timestamp)"
+
+def sqlite_column_reflect_listener(inspector, table, column_info):
+    """Adds parenthesis around SQLite datetime defaults for utcnow."""
+    if column_info['default'] == "datetime('now', 'utc')":
+        column_info['default'] = utcnow_server_default
+
+sqlite_reflect_kwargs = {
+    'listeners': [('column_reflect', sqlite_column_reflect_listener)]
+}
+
+# ===========================================================================
+# HOWTO: Handle alter statements in SQLite
+#
+# def upgrade():
+#     if is_sqlite:
+#         with op.batch_alter_table('table_name', reflect_kwargs=sqlite_reflect_kwargs) as batch_op:
+#             batch_op.alter_column('column_name', type_=sa.Unicode(), server_default='', nullable=False)
+#     else:
+#         op.alter_column('table_name', 'column_name', type_=sa.Unicode(), server_default='', nullable=False)
+#
+# ===========================================================================
+
+
+def upgrade():
+    op.create_index(op.f('ix_attendee_registered'), 'attendee', ['registered'], unique=False)
+
+    # Migrations can't use the app's models, whose mappings follow the code rather than this revision, so
+    # the daily_registration_count table (added empty) is filled by `sep backfill_daily_registrations`
+
+
+def downgrade():
+    op.drop_index(op.f('ix_attendee_registered'), table_name='attendee')
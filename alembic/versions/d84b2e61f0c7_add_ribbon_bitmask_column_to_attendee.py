@@ -0,0 +1,61 @@
+"""Add ribbon bitmask column to attendee
+
+Revision ID: d84b2e61f0c7
+Revises: 5e1d7c09a4b3
+Create Date: 2026-10-18 14:02:51.306674
+
+"""
+
+
+# revision identifiers, used by Alembic.
+revision = 'd84b2e61f0c7'
+down_revision = '5e1d7c09a4b3'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+
+try:
+    is_sqlite = op.get_context().dialect.name == 'sqlite'
+except Exception:
+    is_sqlite = False
+
+if is_sqlite:
+    op.get_context().connection.execute('PRAGMA foreign_keys=ON;')
+    utcnow_server_default = "(datetime('now', 'utc'))"
+else:
+    utcnow_server_default = "timezone('utc', current_timestamp)"
+
+def sqlite_column_reflect_listener(inspector, table, column_info):
+    """Adds parenthesis around SQLite datetime defaults for utcnow."""
+    if column_info['default'] == "datetime('now', 'utc')":
+        column_info['default'] = utcnow_server_default
+
+sqlite_reflect_kwargs = {
+    'listeners': [('column_reflect', sqlite_column_reflect_listener)]
+}
+
+# ===========================================================================
+# HOWTO: Handle alter statements in SQLite
+#
+# def upgrade():
+#     if is_sqlite:
+#         with op.batch_alter_table('table_name', reflect_kwargs=sqlite_reflect_kwargs) as batch_op:
+#             batch_op.alter_column('column_name', type_=sa.Unicode(), server_default='', nullable=False)
+#     else:
+#         op.alter_column('table_name', 'column_name', type_=sa.Unicode(), server_default='', nullable=False)
+#
+# ===========================================================================
+
+
+def upgrade():
+    op.add_column('attendee', sa.Column('ribbon_mask', sa.Integer(), server_default='0', nullable=False))
+
+    # Which bit stands for each ribbon comes from the config, which a migration can't rely on, so the masks
+    # are filled in from the ribbon column by `sep backfill_ribbon_masks`
+
+def downgrade():
+    op.drop_column('attendee', 'ribbon_mask')
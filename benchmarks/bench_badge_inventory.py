@@ -0,0 +1,73 @@
+"""
+Measures how many prereg page loads per second the upgrade badge inventory checks allow, with and
+without the shared BadgeInventory cache. Each simulated page load checks out a session and fetches
+a page of the account's badges, the way the prereg form does, and reads the sponsor and shiny sponsor
+counts once, the way SPONSOR_BADGE_AVAILABLE and SHINY_BADGE_AVAILABLE do during a request.
+
+Runs against a throwaway SQLite database (see throwaway_db.py) seeded with sold upgrade badges, so
+nothing is read from or written to the configured database.
+
+Usage: python benchmarks/bench_badge_inventory.py [page_loads] [attendees]
+"""
+import sys
+import time
+
+from uber.config import c
+from uber.models import Attendee, Session
+from mff_rams_plugin.config import badge_inventory
+from throwaway_db import throwaway_database
+
+PAGE_SIZE = 10
+
+
+def seed_attendees(count):
+    badge_types = [c.ATTENDEE_BADGE, c.ATTENDEE_BADGE, c.SPONSOR_BADGE, c.SHINY_BADGE]
+    with Session() as session:
+        session.add_all([Attendee(first_name='Inventory', last_name=str(i), badge_type=badge_types[i % 4],
+                                  badge_status=c.COMPLETED_STATUS, paid=c.HAS_PAID) for i in range(count)])
+        session.commit()
+
+
+def uncached_badge_count(badge_type):
+    # How get_badge_count_by_type counted badges before BadgeInventory
+    with Session() as session:
+        return session.query(Attendee).filter_by(badge_type=badge_type).filter(
+            ~Attendee.badge_status.in_([c.INVALID_GROUP_STATUS, c.INVALID_STATUS,
+                                        c.IMPORTED_STATUS, c.REFUNDED_STATUS])).count()
+
+
+def page_loads_per_second(count_func, page_loads):
+    """
+    Returns (page loads per second, seconds spent in the inventory counts).
+    """
+    counting = 0
+    start = time.perf_counter()
+    for i in range(page_loads):
+        with Session() as session:
+            session.query(Attendee).order_by(Attendee.last_name).offset(i % 10 * PAGE_SIZE).limit(PAGE_SIZE).all()
+
+        count_start = time.perf_counter()
+        count_func(c.SPONSOR_BADGE)
+        count_func(c.SHINY_BADGE)
+        counting += time.perf_counter() - count_start
+    return page_loads / (time.perf_counter() - start), counting
+
+
+if __name__ == '__main__':
+    page_loads = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    attendees = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+
+    with throwaway_database():
+        seed_attendees(attendees)
+        badge_inventory.invalidate()
+        assert uncached_badge_count(c.SPONSOR_BADGE) == badge_inventory.count(c.SPONSOR_BADGE)
+        assert uncached_badge_count(c.SHINY_BADGE) == badge_inventory.count(c.SHINY_BADGE)
+
+        without_cache, without_cache_counting = page_loads_per_second(uncached_badge_count, page_loads)
+        badge_inventory.invalidate()
+        with_cache, with_cache_counting = page_loads_per_second(badge_inventory.count, page_loads)
+
+    print(f"{page_loads} prereg page loads over {attendees} attendees: "
+          f"{without_cache:.0f}/s without BadgeInventory ({without_cache_counting * 1000:.0f}ms counting), "
+          f"{with_cache:.0f}/s with it ({with_cache_counting * 1000:.0f}ms counting, "
+          f"TTL {c.BADGE_INVENTORY_CACHE_SECONDS}s)")
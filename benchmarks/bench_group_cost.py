@@ -0,0 +1,62 @@
+"""
+Measures saving every badge in an auto-recalc group at once (e.g., editing a dealer group's badges or
+re-importing a group), comparing the old per-attendee cost recalculation in Attendee.save_group_cost
+with recalculating each touched group once per flush in recalculate_group_costs.
+
+Runs against a throwaway SQLite database (see throwaway_db.py), so nothing is written to the configured
+database and no tasks are sent.
+
+Usage: python benchmarks/bench_group_cost.py [badges ...]
+"""
+import sys
+import time
+
+from uber.config import c
+from uber.models import Attendee, Group, Session
+from throwaway_db import throwaway_database
+
+
+def create_group(session, badges):
+    group = Group(name=f'Group cost benchmark ({badges} badges)', tables=1, is_dealer=True, auto_recalc=True)
+    for i in range(badges):
+        group.attendees.append(Attendee(first_name='Benchmark', last_name=str(i), paid=c.PAID_BY_GROUP))
+    session.add(group)
+    session.commit()
+    return group
+
+
+def save_every_badge(session, group, legacy):
+    calls = 0
+    calc_default_cost = Group.calc_default_cost
+
+    def counted_calc_default_cost(self):
+        nonlocal calls
+        calls += 1
+        return calc_default_cost(self)
+
+    Group.calc_default_cost = counted_calc_default_cost
+    try:
+        start = time.perf_counter()
+        for attendee in group.attendees:
+            attendee.badge_printed_name = f"Badge {attendee.last_name} {'legacy' if legacy else 'deferred'}"
+            if legacy:
+                # What save_group_cost did during each attendee's presave adjustments
+                group.cost = group.calc_default_cost()
+        session.commit()
+        return time.perf_counter() - start, calls
+    finally:
+        Group.calc_default_cost = calc_default_cost
+
+
+if __name__ == '__main__':
+    with throwaway_database():
+        for badges in [int(arg) for arg in sys.argv[1:]] or [12, 200]:
+            with Session() as session:
+                group = create_group(session, badges)
+                legacy_time, legacy_calls = save_every_badge(session, group, legacy=True)
+                # The legacy run also triggers one deferred recalculation, so don't count it
+                legacy_calls -= 1
+                deferred_time, deferred_calls = save_every_badge(session, group, legacy=False)
+
+            print(f"{badges}-badge group: per attendee, {legacy_calls} cost calculations in "
+                  f"{legacy_time * 1000:.1f}ms; once per flush, {deferred_calls} in {deferred_time * 1000:.1f}ms")
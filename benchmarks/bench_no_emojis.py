@@ -0,0 +1,87 @@
+"""
+Compares the pre-compiled emoji scanner used by the no_emojis validation against the
+original implementation, which compiled a regex and stringified every column on every call.
+
+Usage: python benchmarks/bench_no_emojis.py [rows]
+"""
+import random
+import re
+import string
+import sys
+import timeit
+
+from mff_rams_plugin.model_checks import no_emojis
+from uber.models import Attendee, Group
+
+LEGACY_EMOJI_REGEX = (
+    r'([\U0000231A-\U0000231B]|[\U000023E9-\U000023EC]|\U000023F0'
+    r'|\U000023F3|[\U000025FD-\U000025FE]|[\U00002614-\U00002615]'
+    r'|[\U00002648-\U00002653]|\U0000267F|\U00002693|\U000026A1'
+    r'|[\U000026AA-\U000026AB]|[\U000026BD-\U000026BE]'
+    r'|[\U000026C4-\U000026C5]|\U000026CE|\U000026D4|\U000026EA'
+    r'|[\U000026F2-\U000026F3]|\U000026F5|\U000026FA|\U000026FD'
+    r'|\U00002705|[\U0000270A-\U0000270B]|\U00002728|\U0000274C'
+    r'|\U0000274E|[\U00002753-\U00002755]|\U00002757'
+    r'|[\U00002795-\U00002797]|\U000027B0|\U000027BF'
+    r'|[\U00002B1B-\U00002B1C]|\U00002B50|\U00002B55|\U0001F004'
+    r'|\U0001F0CF|\U0001F18E|[\U0001F191-\U0001F19A]|\U0001F201'
+    r'|\U0001F21A|\U0001F22F|[\U0001F232-\U0001F236]'
+    r'|[\U0001F238-\U0001F23A]|[\U0001F250-\U0001F251]'
+    r'|[\U0001F300-\U0001F320]|[\U0001F32D-\U0001F335]'
+    r'|[\U0001F337-\U0001F37C]|[\U0001F37E-\U0001F393]'
+    r'|[\U0001F3A0-\U0001F3CA]|[\U0001F3CF-\U0001F3D3]'
+    r'|[\U0001F3E0-\U0001F3F0]|\U0001F3F4|[\U0001F3F8-\U0001F43E]'
+    r'|\U0001F440|[\U0001F442-\U0001F4FC]|[\U0001F4FF-\U0001F53D]'
+    r'|[\U0001F54B-\U0001F54E]|[\U0001F550-\U0001F567]'
+    r'|[\U0001F595-\U0001F596]|[\U0001F5FB-\U0001F64F]'
+    r'|[\U0001F680-\U0001F6C5]|\U0001F6CC|\U0001F6D0'
+    r'|[\U0001F6EB-\U0001F6EC]|[\U0001F910-\U0001F918]'
+    r'|[\U0001F980-\U0001F984]|\U0001F9C0'
+    r'|[\U0001F1E6-\U0001F1FC][\U0001F1E6-\U0001F1FF])')
+
+
+def legacy_no_emojis(model):
+    for column in model.__table__.columns:
+        emojis = re.compile(LEGACY_EMOJI_REGEX)
+        if re.search(emojis, str(getattr(model, column.name))):
+            return ('', 'Fields cannot contain emoji.')
+
+
+def random_text(rng, length):
+    # Mostly ASCII with the occasional accented character or emoji, like real registration data
+    alphabet = string.ascii_letters + string.digits + ' '
+    text = ''.join(rng.choice(alphabet) for _ in range(length))
+    if rng.random() < 0.1:
+        text += rng.choice('\u00e9\u00f1\u00fc\u00e5')
+    if rng.random() < 0.01:
+        text += rng.choice(['\U0001F43E', '\u2728', '\U0001F1FA\U0001F1F8'])
+    return text
+
+
+def build_batch(rows, seed=2024):
+    rng = random.Random(seed)
+    batch = []
+    for i in range(rows):
+        if i % 5 == 0:
+            model = Group(name=random_text(rng, 20), description=random_text(rng, 200),
+                          website=random_text(rng, 30), social_media=random_text(rng, 40))
+        else:
+            model = Attendee(first_name=random_text(rng, 8), last_name=random_text(rng, 10),
+                             badge_printed_name=random_text(rng, 12), email=random_text(rng, 20) + '@example.com',
+                             address1=random_text(rng, 25), city=random_text(rng, 10))
+        batch.append(model)
+    return batch
+
+
+def run(func, batch):
+    return [func(model) for model in batch]
+
+
+if __name__ == '__main__':
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    batch = build_batch(rows)
+    assert run(legacy_no_emojis, batch) == run(no_emojis, batch)
+
+    legacy = min(timeit.repeat(lambda: run(legacy_no_emojis, batch), number=1, repeat=3))
+    current = min(timeit.repeat(lambda: run(no_emojis, batch), number=1, repeat=3))
+    print(f"no_emojis over {rows} rows: legacy {legacy:.3f}s, current {current:.3f}s ({legacy / current:.1f}x)")
@@ -0,0 +1,70 @@
+"""
+Replays typical admin traffic against kid-in-tow, parent-in-tow and not-attending badges and reports
+how many receipt updates the not_attending_need_not_pay and in_tow_need_not_pay presave adjustments
+used to run (one per adjustment, every time an existing badge was saved) versus how many are now
+queued (only when paid actually changes, merged per attendee per transaction).
+
+Runs against a throwaway SQLite database (see throwaway_db.py), so nothing is written to the configured
+database. Receipt update tasks, like every other after-commit task, are counted rather than sent.
+
+Usage: python benchmarks/bench_receipt_updates.py [attendees]
+"""
+import random
+import sys
+
+from uber.config import c
+from uber.models import Attendee, Session
+from mff_rams_plugin import tasks
+from throwaway_db import throwaway_database
+
+
+def replay_admin_traffic(session, attendees, rounds=5):
+    # Mostly notes and name edits, some check-ins, and the occasional badge being marked not attending
+    for _ in range(rounds):
+        for attendee in attendees:
+            action = random.random()
+            if action < 0.6:
+                attendee.admin_notes = (attendee.admin_notes or '') + '.'
+            elif action < 0.8:
+                attendee.badge_printed_name = f'Badge {random.randint(0, 999)}'
+            elif action < 0.95:
+                attendee.admin_notes = (attendee.admin_notes or '') + '!'
+                attendee.badge_printed_name = f'Badge {random.randint(0, 999)}'
+                session.commit()  # Some admins save twice in a row
+                attendee.admin_notes += '?'
+            else:
+                attendee.badge_status = c.NOT_ATTENDING
+            session.commit()
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    random.seed(0)
+
+    legacy_updates = 0
+
+    queue_need_not_pay_receipt_update = Attendee.queue_need_not_pay_receipt_update
+
+    def counted_queue_need_not_pay_receipt_update(self):
+        global legacy_updates
+        # Each adjustment that calls this used to run update_receipt directly for existing attendees
+        legacy_updates += 0 if self.is_new else 1
+        queue_need_not_pay_receipt_update(self)
+
+    Attendee.queue_need_not_pay_receipt_update = counted_queue_need_not_pay_receipt_update
+
+    badge_types = [c.KID_IN_TOW_BADGE, c.PARENT_IN_TOW_BADGE, c.ATTENDEE_BADGE, c.ATTENDEE_BADGE]
+    with throwaway_database() as sent, Session() as session:
+        attendees = [Attendee(first_name='Receipt', last_name=str(i), badge_type=badge_types[i % 4],
+                              badge_status=c.NOT_ATTENDING if i % 7 == 0 else c.COMPLETED_STATUS, paid=c.HAS_PAID)
+                     for i in range(count)]
+        session.add_all(attendees)
+        session.commit()
+        # Only count what the replayed traffic queues, not the attendees being created
+        sent.clear()
+        replay_admin_traffic(session, attendees)
+
+    batches = sent[tasks.update_need_not_pay_receipts.name]
+    queued_tasks, queued_updates = len(batches), sum(len(attendee_ids) for attendee_ids in batches)
+    print(f"Replayed admin traffic on {count} badges: {legacy_updates} receipt updates before, "
+          f"{queued_updates} now in {queued_tasks} tasks ({legacy_updates - queued_updates} suppressed)")
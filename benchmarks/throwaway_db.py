@@ -0,0 +1,36 @@
+"""
+Setup for benchmarks that write attendees or groups, so they never touch the database configured for this
+install or send anything to its task broker.
+"""
+import tempfile
+from collections import defaultdict
+from contextlib import contextmanager
+
+from sqlalchemy import create_engine
+
+from uber.models import Session
+from mff_rams_plugin import tasks
+
+
+@contextmanager
+def throwaway_database():
+    """
+    Points Session at a new SQLite database in a temporary directory, the same way the test suite's sqlite_db
+    fixture does, and records the tasks queued by queue_after_commit instead of sending them. Yields
+    {task name: [each batch of values sent]}.
+    """
+    sent = defaultdict(list)
+    stubbed = {task: task.delay for task in vars(tasks).values() if hasattr(task, 'delay')}
+    for task in stubbed:
+        task.delay = lambda values, name=task.name: sent[name].append(values)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        Session.engine = create_engine(f"sqlite:///{tmp_dir}/benchmark.db")
+        Session.session_factory.configure(bind=Session.engine)
+        Session.initialize_db(modify_tables=True, drop=True)
+        try:
+            yield sent
+        finally:
+            Session.engine.dispose()
+            for task, delay in stubbed.items():
+                task.delay = delay
@@ -5,9 +5,11 @@ from uber.utils import mount_site_sections, static_overrides
 from .config import config
 from . import forms  # noqa: F401
 from . import models  # noqa: F401
+from . import badge_numbers  # noqa: F401
 from . import model_checks  # noqa: F401
 from . import automated_emails  # noqa: F401
 from . import receipt_items  # noqa: F401
+from . import sep_commands  # noqa: F401
 from .tasks import *  # noqa: F401,E402,F403
 from .validations import *  # noqa: F401,E402,F403
 
@@ -26,13 +28,11 @@ def prereg_cart_checks(self, session):
     if error:
         return error
 
-    account = session.current_attendee_account()
-    for attendee in self.attendees:
-        if attendee.badge_type == c.PARENT_IN_TOW_BADGE:
-            paid_minors_in_cart = any([a for a in self.attendees if a.birthdate and a.age_now_or_at_con < 18 \
-                                       and a.total_cost_if_valid])
-            if not account.pit_eligible and not paid_minors_in_cart:
-                return "You cannot register an Accompanying Adult badge when you have no paid badges under 18 years old."
+    pit_in_cart, paid_minors_in_cart = c.PREREG_CART_CONTEXT.cart_pit_status(self.attendees)
+    if pit_in_cart and not paid_minors_in_cart:
+        pit_eligible, has_pit_badge = c.PREREG_CART_CONTEXT.account_pit_status(session)
+        if not pit_eligible:
+            return "You cannot register an Accompanying Adult badge when you have no paid badges under 18 years old."
 
 
 PreregCart.prereg_cart_checks = prereg_cart_checks
\ No newline at end of file
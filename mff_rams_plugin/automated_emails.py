@@ -1,14 +1,26 @@
+from sqlalchemy import func, or_, select
+
 from uber.automated_emails import ArtShowAppEmailFixture, AutomatedEmailFixture, MarketplaceEmailFixture, StopsEmailFixture
 from uber.config import c
-from uber.models import Attendee, AttendeeAccount, AutomatedEmail, LotteryApplication
+from uber.models import (ArtShowApplication, Attendee, AttendeeAccount, AutomatedEmail, Group,
+                         LotteryApplication)
 from uber.utils import before, days_before, days_after
 
 
+# Every fixture below has a query= prefilter so the email job only evaluates its lambda against rows
+# that could possibly match. Prefilters must never exclude a row the lambda would accept; run
+# `sep check_automated_email_prefilters` after changing either one.
+
+# The fixtures registered before this module's, so MFF_EMAIL_IDENTS can pick out the ones defined (or replaced) here
+_fixtures_before_mff = dict(AutomatedEmail._fixtures)
+
+
 AutomatedEmailFixture(
     Attendee,
     'A Message from Furfest Accessibility Services',
     'accessibility_info.html',
     lambda a: a.requested_accessibility_services,
+    query=Attendee.requested_accessibility_services == True,  # noqa: E712
     when=days_before(7, c.EPOCH),
     sender='accessibility@furfest.org',
     ident='accessibility_info',
@@ -20,6 +32,8 @@ AutomatedEmailFixture(
     '{EVENT_NAME} registration confirmed',
     'reg_workflow/attendee_confirmation.html',
     lambda a: not a.placeholder and a.badge_type in [c.PARENT_IN_TOW_BADGE, c.KID_IN_TOW_BADGE],
+    query=(Attendee.placeholder == False,  # noqa: E712
+           Attendee.badge_type.in_([c.PARENT_IN_TOW_BADGE, c.KID_IN_TOW_BADGE])),
     allow_at_the_con=True,
     ident='kitpit_badge_confirmed')
 
@@ -28,10 +42,7 @@ MarketplaceEmailFixture(
         'Payment Now Due for your Midwest FurFest Dealer Group and Registrations',
         'dealers/payment_ready.txt',
         lambda g: g.status in c.DEALER_ACCEPTED_STATUSES and days_after(30, g.approved)() and g.is_unpaid,
-        # query=and_(
-        #     Group.status == c.APPROVED,
-        #     Group.approved < (func.now() - timedelta(days=30)),
-        #     Group.is_unpaid == True),
+        query=Group.status.in_(c.DEALER_ACCEPTED_STATUSES),
         needs_approval=True,
         ident='dealer_reg_payment_reminder')
 
@@ -40,30 +51,36 @@ MarketplaceEmailFixture(
     'Your {EVENT_NAME} ({EVENT_DATE}) Dealer registration is due in one week',
     'dealers/payment_reminder.txt',
     lambda g: g.status in [c.APPROVED, c.SHARED] and days_before(7, g.dealer_payment_due, 2)() and g.is_unpaid,
+    query=(Group.status.in_([c.APPROVED, c.SHARED]), Group.dealer_payment_due > func.now()),
     ident='dealer_reg_payment_reminder_due_soon')
 
 MarketplaceEmailFixture(
     'Last chance to pay for your {EVENT_NAME} ({EVENT_DATE}) Dealer registration',
     'dealers/payment_reminder_final.txt',
     lambda g: g.status in [c.APPROVED, c.SHARED] and days_before(2, g.dealer_payment_due)() and g.is_unpaid,
+    query=(Group.status.in_([c.APPROVED, c.SHARED]), Group.dealer_payment_due > func.now()),
     ident='dealer_reg_payment_reminder_last_chance')
 
 MarketplaceEmailFixture(
     'Your {EVENT_NAME} ({EVENT_DATE}) dealer application has been waitlisted',
     'dealers/pending_waitlisted.txt',
     lambda g: g.status == c.WAITLISTED and (not c.DEALER_REG_DEADLINE or g.registered < c.DEALER_REG_DEADLINE),
+    query=(Group.status == c.WAITLISTED, Group.registered < c.DEALER_REG_DEADLINE) if c.DEALER_REG_DEADLINE
+    else Group.status == c.WAITLISTED,
     ident='dealer_pending_now_waitlisted')
 
 MarketplaceEmailFixture(
     'Your {EVENT_NAME} ({EVENT_DATE}) dealer application has been declined',
     'dealers/declined.txt',
     lambda g: g.status == c.DECLINED,
+    query=Group.status == c.DECLINED,
     ident='dealer_pending_declined')
 
 ArtShowAppEmailFixture(
     '{EVENT_NAME} Charity Donations needed',
     'art_show/charity.txt',
     lambda a: a.status == c.APPROVED,
+    query=ArtShowApplication.status == c.APPROVED,
     when=before(c.ART_SHOW_CHARITY_DEADLINE),
     ident='art_show_charity')
 
@@ -71,12 +88,14 @@ StopsEmailFixture(
     'Volunteering At {EVENT_NAME}!',
     'volunteer_interest.html',
     lambda a: c.VOLUNTEER_RIBBON in a.ribbon_ints,
+    query=Attendee.has_ribbon(c.VOLUNTEER_RIBBON),
     ident='volunteer_interest')
 
 StopsEmailFixture(
     '{EVENT_NAME} Volunteering Update!',
     'volunteer_update.html',
     lambda a: c.VOLUNTEER_RIBBON in a.ribbon_ints,
+    query=Attendee.has_ribbon(c.VOLUNTEER_RIBBON),
     ident='volunteer_update')
 
 AutomatedEmailFixture(
@@ -85,6 +104,9 @@ AutomatedEmailFixture(
     'hotel_lottery/lottery_phone.html',
     lambda a: a.cellphone == '' and a.attendee and a.attendee.cellphone == '' and a.status == c.COMPLETE and a.current_step == (
         a.last_step - 5) and a.entry_type != c.GROUP_ENTRY,
+    query=(LotteryApplication.cellphone == '', LotteryApplication.status == c.COMPLETE,
+           LotteryApplication.attendee.has(Attendee.cellphone == ''),
+           or_(LotteryApplication.entry_type == None, LotteryApplication.entry_type != c.GROUP_ENTRY)),  # noqa: E711
     sender=c.HOTELS_EMAIL,
     ident='lottery_phone'
 )
@@ -93,7 +115,28 @@ AutomatedEmailFixture(
     AttendeeAccount,
     '{EVENT_NAME} Hotel Lottery Instructions',
     'hotel_lottery/instructions.html',
-    lambda aa: aa.hotel_eligible_attendees and c.AFTER_HOTEL_LOTTERY_FORM_START and (
+    lambda aa: c.AFTER_HOTEL_LOTTERY_FORM_START and aa.hotel_eligible_attendees and (
         len(aa.hotel_eligible_staff) != len(aa.hotel_eligible_attendees)),
+    query=AttendeeAccount.has_hotel_eligible_non_staff(),
     sender=c.HOTELS_EMAIL,
-    ident='hotel_lottery_instructions')
\ No newline at end of file
+    ident='hotel_lottery_instructions')
+
+
+MFF_EMAIL_IDENTS = [ident for ident, fixture in AutomatedEmail._fixtures.items()
+                    if _fixtures_before_mff.get(ident) is not fixture]
+
+
+def prefilter_misses(session, ident):
+    """
+    Returns the ids of rows which the fixture's filter accepts but its query= prefilter excludes, by
+    evaluating the filter against every row of the fixture's model. Any id returned is a bug in the prefilter.
+    Exceptions from the filter are raised, since we can't tell whether it would have accepted the row.
+    """
+    fixture = AutomatedEmail._fixtures[ident]
+    prefiltered = select(fixture.model.id).where(*fixture.query)
+
+    misses = []
+    for model_inst in session.query(fixture.model).filter(~fixture.model.id.in_(prefiltered)):
+        if fixture.filter(model_inst):
+            misses.append(model_inst.id)
+    return misses
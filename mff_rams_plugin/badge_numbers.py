@@ -0,0 +1,242 @@
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from sqlalchemy import bindparam, event, update
+from sqlalchemy.orm import Session as SASession
+
+from uber.badge_funcs import get_real_badge_type
+from uber.config import c
+from uber.models import Attendee, BadgeInfo
+from uber.utils import add_opt, remove_opt
+from mff_rams_plugin.models import ribbon_ints_of, ribbon_mask_of
+
+
+# Key in Session.info for the BadgeInfo ids this session was handed but hasn't committed yet
+RESERVED_BADGES = 'mff_reserved_badges'
+
+
+def range_badge_type(badge_type, ribbon_ints):
+    # Staff ribbons get staff badge numbers, whatever their badge type
+    return c.STAFF_BADGE if c.STAFF_RIBBON in ribbon_ints else get_real_badge_type(badge_type)
+
+
+def badge_range_type(attendee):
+    return c.STAFF_BADGE if attendee.has_ribbon(c.STAFF_RIBBON) else get_real_badge_type(attendee.badge_type)
+
+
+class BadgeNumberAllocator:
+    """
+    Hands out unassigned BadgeInfo rows from each badge type's range in c.BADGE_RANGES, lowest numbers first,
+    any number at a time with a single query. Rows are locked with SKIP LOCKED, so other processes assigning
+    numbers at the same time skip past them instead of waiting. Within this process, rows handed to a
+    transaction that hasn't finished yet are also skipped, which keeps databases without row locks
+    (i.e., SQLite) from handing the same number out twice.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reserved = set()
+
+    def allocate(self, session, badge_type, count=1):
+        """
+        Returns up to count unassigned badges in badge_type's range, in order. There may be fewer than
+        count if the range is running out.
+        """
+        lower_bound, upper_bound = c.BADGE_RANGES[badge_type]
+        badges = []
+        while len(badges) < count:
+            with self._lock:
+                skipped = set(self._reserved)
+            wanted = count - len(badges)
+
+            # The query runs without the lock, so another thread may be handed some of the same rows meanwhile
+            query = session.query(BadgeInfo).filter(BadgeInfo.attendee_id == None,  # noqa: E711
+                                                    BadgeInfo.ident >= lower_bound, BadgeInfo.ident <= upper_bound)
+            if skipped:
+                query = query.filter(BadgeInfo.id.notin_(skipped))
+            found = query.order_by(BadgeInfo.ident).limit(wanted).with_for_update(skip_locked=True).all()
+
+            with self._lock:
+                claimed = [badge for badge in found if badge.id not in self._reserved]
+                self._reserved.update(badge.id for badge in claimed)
+            session.info.setdefault(RESERVED_BADGES, set()).update(badge.id for badge in claimed)
+            badges.extend(claimed)
+
+            if len(found) < wanted:
+                break  # The range is running out
+        return sorted(badges, key=lambda badge: badge.ident)
+
+    def release(self, session):
+        reserved = session.info.pop(RESERVED_BADGES, None)
+        if reserved:
+            with self._lock:
+                self._reserved.difference_update(reserved)
+
+    def update_badges(self, session, attendees):
+        """
+        Moves each attendee whose badge number is outside of their badge type's range to a new number, and gives
+        one to each attendee who needs a number but doesn't have one, allocating each badge type's numbers in
+        one batch. Checked-in attendees are never renumbered.
+        """
+        from uber.badge_funcs import needs_badge_num
+
+        needs_number = defaultdict(list)
+        for attendee in attendees:
+            if attendee.checked_in:
+                continue
+
+            badge_type = badge_range_type(attendee)
+            lower_bound, upper_bound = c.BADGE_RANGES[badge_type]
+            if attendee.active_badge and attendee.active_badge.attendee_id:
+                if lower_bound <= attendee.badge_num <= upper_bound:
+                    continue
+                attendee.active_badge.unassign()
+                session.add(attendee.active_badge)
+
+            if needs_badge_num(attendee):
+                needs_number[badge_type].append(attendee)
+
+        for badge_type, waiting in needs_number.items():
+            for attendee, badge in zip(waiting, self.allocate(session, badge_type, len(waiting))):
+                badge.assign(attendee.id)
+                session.add(badge)
+
+
+badge_numbers = BadgeNumberAllocator()
+
+
+@event.listens_for(SASession, 'after_transaction_end')
+def release_reserved_badges(session, transaction):
+    if transaction.parent is None:
+        badge_numbers.release(session)
+
+
+BADGE_RESYNC_BATCH_SIZE = 1000
+
+
+def resynced_badge(badge_type, ribbon, staffing, badge_status, badge_num):
+    """
+    Returns the badge type, ribbon and staffing flag that saving an attendee with these values would leave
+    them with, following Attendee.staffing_badge_and_ribbon_adjustments and Attendee.badge_adjustments.
+    """
+    ribbon_ints = ribbon_ints_of(ribbon)
+
+    if badge_type == c.STAFF_BADGE or c.STAFF_RIBBON in ribbon_ints:
+        ribbon_ints = ribbon_ints_of(remove_opt(ribbon_ints, c.VOLUNTEER_RIBBON))
+    elif staffing and c.VOLUNTEER_RIBBON not in ribbon_ints:
+        ribbon_ints = ribbon_ints_of(add_opt(ribbon_ints, c.VOLUNTEER_RIBBON))
+
+    if badge_type == c.STAFF_BADGE or c.STAFF_RIBBON in ribbon_ints:
+        staffing = True
+
+    if badge_num and badge_num in range(c.BADGE_RANGES[c.STAFF_BADGE][0], c.BADGE_RANGES[c.STAFF_BADGE][1]) \
+            and badge_status == c.IMPORTED_STATUS and badge_type != c.STAFF_BADGE:
+        ribbon_ints = ribbon_ints_of(add_opt(ribbon_ints, c.STAFF_RIBBON))
+
+    if badge_type == c.PSEUDO_DEALER_BADGE:
+        ribbon_ints = ribbon_ints_of(add_opt(ribbon_ints, c.DEALER_RIBBON))
+
+    return get_real_badge_type(badge_type), ribbon_ints, staffing
+
+
+class BadgeResync:
+    """
+    Brings every attendee's badge type, ribbons and badge number in line with what their presave adjustments
+    would set, without saving attendees one at a time. This is for after a ribbon import, or after
+    c.BADGE_RANGES changes between years.
+
+    compute() reads the relevant columns for every attendee in one pass and works out what needs to change.
+    apply() writes badge type, ribbon and staffing changes with batched UPDATEs, frees badge numbers that are
+    out of range, then gives out new numbers with one allocation per badge type. Like update_badges,
+    checked-in attendees are never renumbered. Attendee presave adjustments don't run for these changes.
+    """
+    def __init__(self, session, batch_size=BADGE_RESYNC_BATCH_SIZE):
+        self.session = session
+        self.batch_size = batch_size
+        self.changes = {}  # Attendee id -> {column: (current value, new value)}
+        self.names = {}
+        self.updates = []  # Bound parameters for the UPDATE of each attendee whose badge type or ribbons change
+        self.unassign = []  # BadgeInfo ids of numbers outside their attendee's range
+        self.renumber = defaultdict(list)  # Badge type -> ids of attendees who need a number in its range
+        self.timings = {}
+
+    @contextmanager
+    def timed(self, step):
+        start = time.perf_counter()
+        yield
+        self.timings[step] = self.timings.get(step, 0) + time.perf_counter() - start
+
+    def compute(self):
+        from uber.badge_funcs import needs_badge_num
+
+        with self.timed('compute'):
+            rows = self.session.query(
+                Attendee.id, Attendee.first_name, Attendee.last_name, Attendee.badge_type, Attendee.ribbon,
+                Attendee.staffing, Attendee.badge_status, Attendee.checked_in, Attendee.is_valid,
+                BadgeInfo.id, BadgeInfo.ident).outerjoin(Attendee.active_badge).yield_per(self.batch_size)
+
+            for (attendee_id, first_name, last_name, badge_type, ribbon, staffing, badge_status,
+                 checked_in, is_valid, badge_id, badge_num) in rows:
+                new_type, new_ribbon_ints, new_staffing = resynced_badge(
+                    badge_type, ribbon, staffing, badge_status, badge_num)
+
+                changes = {}
+                if new_type != badge_type:
+                    changes['badge_type'] = (badge_type, new_type)
+                if set(new_ribbon_ints) != set(ribbon_ints_of(ribbon)):
+                    changes['ribbon'] = (ribbon, ','.join(map(str, new_ribbon_ints)))
+                if new_staffing != staffing:
+                    changes['staffing'] = (staffing, new_staffing)
+                if changes:
+                    self.updates.append({'attendee_id': attendee_id, 'new_badge_type': new_type,
+                                         'new_ribbon': changes['ribbon'][1] if 'ribbon' in changes else ribbon,
+                                         'new_ribbon_mask': ribbon_mask_of(new_ribbon_ints),
+                                         'new_staffing': new_staffing})
+
+                if not checked_in:
+                    range_type = range_badge_type(new_type, new_ribbon_ints)
+                    lower_bound, upper_bound = c.BADGE_RANGES[range_type]
+                    if badge_num and not lower_bound <= badge_num <= upper_bound:
+                        self.unassign.append(badge_id)
+                        changes['badge_num'] = (badge_num, None)
+                        badge_num = None
+                    if not badge_num and is_valid and first_name and needs_badge_num(badge_type=new_type):
+                        self.renumber[range_type].append(attendee_id)
+                        changes['badge_num'] = (changes.get('badge_num', (None, ))[0], f'next free in {lower_bound}-{upper_bound}')
+
+                if changes:
+                    self.changes[attendee_id] = changes
+                    self.names[attendee_id] = f'{first_name} {last_name}'
+        return self
+
+    def batches(self, items):
+        for i in range(0, len(items), self.batch_size):
+            yield items[i:i + self.batch_size]
+
+    def apply(self):
+        attendee_table = Attendee.__table__
+        with self.timed('update attendees'):
+            statement = update(attendee_table).where(attendee_table.c.id == bindparam('attendee_id')).values(
+                badge_type=bindparam('new_badge_type'), ribbon=bindparam('new_ribbon'),
+                ribbon_mask=bindparam('new_ribbon_mask'), staffing=bindparam('new_staffing'))
+            for batch in self.batches(self.updates):
+                self.session.execute(statement, batch)
+
+        with self.timed('free badge numbers'):
+            for batch in self.batches(self.unassign):
+                for badge in self.session.query(BadgeInfo).filter(BadgeInfo.id.in_(batch)):
+                    badge.unassign()
+                self.session.flush()
+
+        with self.timed('assign badge numbers'):
+            for badge_type, attendee_ids in self.renumber.items():
+                for attendee_id, badge in zip(attendee_ids, badge_numbers.allocate(self.session, badge_type,
+                                                                                   len(attendee_ids))):
+                    badge.assign(attendee_id)
+            self.session.flush()
+
+    def diff_lines(self):
+        for attendee_id, changes in self.changes.items():
+            described = ', '.join(f'{column}: {old} -> {new}' for column, (old, new) in changes.items())
+            yield f'{self.names[attendee_id]} ({attendee_id}): {described}'
@@ -1,8 +1,12 @@
+import threading
+import time
 from collections import defaultdict
-from datetime import timedelta
+from datetime import datetime, timedelta
 from pockets.autolog import log
 from pockets import listify
 from pathlib import Path
+from pytz import UTC
+from sqlalchemy import inspect
 
 from uber.config import c, Config, dynamic, parse_config, request_cached_property
 from uber.menu import MenuItem
@@ -26,12 +30,216 @@ c.MENU.append_menu_item(
     MenuItem(name='Midwest FurFest', submenu=[
         MenuItem(name='Comped Badges', href='../mff_reports/comped_badges'),
         MenuItem(name='Daily Attendance', href='../mff_reports/attendance_graph'),
+        MenuItem(name='On-Sale Velocity', href='../mff_reports/registration_velocity'),
+        MenuItem(name='Late Dealer Payments', href='../mff_reports/late_dealers'),
         MenuItem(name='Hotel Lottery Admin', href='../hotel_lottery_admin/'),
         MenuItem(name='Artist Marketplace Admin', href='../marketplace_admin/'),
     ])
 )
 
 
+class BadgeInventory:
+    """
+    Process-wide counts of upgrade badges, which have limited availability. Every upgrade type
+    is counted by one grouped query, and the counts are reused for BADGE_INVENTORY_CACHE_SECONDS
+    or until invalidate() is called because a commit changed an attendee's badge type or status.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {}
+        self._expires = 0
+        self._generation = 0
+
+    def count(self, badge_type):
+        with self._lock:
+            if time.monotonic() < self._expires:
+                return self._counts.get(badge_type, 0)
+            generation = self._generation
+
+        # Query without holding the lock, so other requests aren't stuck waiting on the database
+        counts = self._query_counts()
+        with self._lock:
+            # If the cache was invalidated while we were counting, these counts may be out of date already
+            if generation == self._generation:
+                self._counts = counts
+                self._expires = time.monotonic() + c.BADGE_INVENTORY_CACHE_SECONDS
+        return counts.get(badge_type, 0)
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._expires = 0
+
+    def _query_counts(self):
+        # Since sponsor and shiny sponsor badges are upgrades with limited availability,
+        # this expands how they're counted to match how preordered merch is counted
+        from sqlalchemy import func
+        from uber.models import Session, Attendee
+
+        with Session() as session:
+            counts = session.query(Attendee.badge_type, func.count(Attendee.id)).filter(
+                Attendee.badge_type.in_(list(c.BADGE_TYPE_PRICES)),
+                ~Attendee.badge_status.in_([c.INVALID_GROUP_STATUS, c.INVALID_STATUS,
+                                            c.IMPORTED_STATUS, c.REFUNDED_STATUS])).group_by(Attendee.badge_type)
+            return dict(counts)
+
+
+badge_inventory = BadgeInventory()
+
+
+class RegistrationVelocity:
+    """
+    Completed registrations (and upgrades, by badge type) per minute for the last REGISTRATION_VELOCITY_MINUTES
+    minutes, for watching inventory burn while badges go on sale. The counts live in fixed-size ring buffers
+    fed when attendee saves commit, so polling them never touches the attendee table.
+
+    The buffers are loaded by one windowed query on first use, then again every
+    REGISTRATION_VELOCITY_RESYNC_SECONDS to pick up registrations taken by other processes. Both the query
+    and record() put each registration in the minute of its registered time, and record() is only called
+    once the registration commits.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rings = {}  # None is every completed registration, otherwise an upgrade badge type
+        self._latest_minute = 0
+        self._resync_at = 0
+
+    @staticmethod
+    def _minute(when=None):
+        return int((when or localized_now()).timestamp() // 60)
+
+    @property
+    def _size(self):
+        return c.REGISTRATION_VELOCITY_MINUTES
+
+    def record(self, badge_type=None, when=None):
+        minute = self._minute(when)
+        with self._lock:
+            # Until the first load, the windowed query will count this for us
+            if not self._rings or minute <= self._latest_minute - self._size:
+                return
+            self._advance(minute)
+            self._rings.setdefault(badge_type, [0] * self._size)[minute % self._size] += 1
+
+    def per_minute(self, now=None):
+        """
+        Returns {None or badge type: [count for each minute, oldest first]}, ending with the current minute.
+        """
+        minute = self._minute(now)
+        with self._lock:
+            resync = time.monotonic() >= self._resync_at
+            if resync:
+                # Only one caller needs to reload; the rest keep reading the current buffers meanwhile
+                self._resync_at = time.monotonic() + c.REGISTRATION_VELOCITY_RESYNC_SECONDS
+
+        if resync:
+            # Query without holding the lock, so registrations being recorded don't wait on the database
+            rings = self._load(minute)
+            with self._lock:
+                self._rings = rings
+                self._latest_minute = max(self._latest_minute, minute)
+
+        with self._lock:
+            self._advance(minute)
+            indexes = [m % self._size for m in range(minute - self._size + 1, minute + 1)]
+            return {badge_type: [ring[i] for i in indexes] for badge_type, ring in self._rings.items()}
+
+    def _advance(self, minute):
+        # Clear the buckets for any minutes that passed since the newest one so they can be reused
+        for m in range(max(self._latest_minute + 1, minute - self._size + 1), minute + 1):
+            for ring in self._rings.values():
+                ring[m % self._size] = 0
+        self._latest_minute = max(self._latest_minute, minute)
+
+    def _load(self, minute):
+        from uber.models import Session
+        from mff_rams_plugin.models import count_completed_per_minute
+
+        start = datetime.fromtimestamp((minute - self._size + 1) * 60, tz=UTC)
+        with Session() as session:
+            counts = count_completed_per_minute(session, start, start + timedelta(minutes=self._size))
+
+        rings = {None: [0] * self._size}
+        rings.update({badge_type: [0] * self._size for badge_type in c.BADGE_TYPE_PRICES})
+        for (registered, badge_type), count in counts.items():
+            index = self._minute(registered.replace(tzinfo=UTC)) % self._size
+            rings[None][index] += count
+            if badge_type in c.BADGE_TYPE_PRICES:
+                rings[badge_type][index] += count
+        return rings
+
+
+registration_velocity = RegistrationVelocity()
+
+
+class PreregCartContext:
+    """
+    What the prereg pages need to know about the current attendee account and cart to decide
+    whether to offer (or allow) an accompanying adult badge. One instance lives for each request
+    as c.PREREG_CART_CONTEXT, so the account is only looked up once and the cart is only scanned once.
+    Nothing is worked out until a page asks, and saving one of the account's attendees starts over.
+    """
+    def __init__(self):
+        self._account = None
+        self._account_looked_up = False
+        self._account_pit_status = None
+        self._cart_pit_status = None
+
+    def account_pit_status(self, session=None):
+        """
+        Returns (pit_eligible, has_pit_badge) for the logged-in attendee account. On prereg pages, the page
+        handler has usually looked up the account already (see SessionMixin.current_attendee_account), so
+        this reuses that account while the handler's session is open instead of opening one of its own.
+        """
+        if self._account_pit_status is None:
+            if session is not None:
+                self.set_account(session.current_attendee_account())
+            elif not self._account_looked_up or (self._account and inspect(self._account).session is None):
+                from uber.models import Session
+                with Session() as session:
+                    self.set_account(session.current_attendee_account())
+                    self._account_pit_status = self._get_account_pit_status(self._account)
+                return self._account_pit_status
+            self._account_pit_status = self._get_account_pit_status(self._account)
+        return self._account_pit_status
+
+    def set_account(self, account):
+        self._account, self._account_looked_up = account, True
+
+    def invalidate(self):
+        self._account_pit_status = None
+        self._cart_pit_status = None
+
+    @staticmethod
+    def _get_account_pit_status(account):
+        return (bool(account.pit_eligible), bool(account.pit_badge)) if account else (False, False)
+
+    def cart_pit_status(self, attendees=None):
+        """
+        Returns (pit_in_cart, paid_minors_in_cart) for the given attendees. If no attendees are
+        passed, this checks the unpaid preregistrations in the session's cart, which are only
+        turned back into attendees once per request.
+        """
+        if attendees is not None:
+            return self._get_cart_pit_status(attendees)
+
+        if self._cart_pit_status is None:
+            from uber.payments import PreregCart
+            cart = PreregCart(listify(PreregCart.unpaid_preregs.values()))
+            self._cart_pit_status = self._get_cart_pit_status(cart.attendees)
+        return self._cart_pit_status
+
+    def _get_cart_pit_status(self, attendees):
+        pit_in_cart, paid_minors_in_cart = False, False
+        for attendee in attendees:
+            if attendee.badge_type == c.PARENT_IN_TOW_BADGE:
+                pit_in_cart = True
+            elif not paid_minors_in_cart and attendee.birthdate and attendee.age_now_or_at_con < 18 \
+                    and attendee.total_cost_if_valid:
+                paid_minors_in_cart = True
+        return pit_in_cart, paid_minors_in_cart
+
+
 @Config.mixin
 class ExtraConfig:
     @property
@@ -88,12 +296,15 @@ class ExtraConfig:
         return self.TABLE_PRICES[table_count]
     
     def get_badge_count_by_type(self, badge_type):
+        if badge_type in c.BADGE_TYPE_PRICES:
+            return badge_inventory.count(badge_type)
+
         # Since sponsor and shiny sponsor badges are upgrades with limited availability,
         # this expands how they're counted to match how preordered merch is counted
         from uber.models import Session, Attendee
         with Session() as session:
             count = session.query(Attendee).filter_by(badge_type=badge_type).filter(
-                    ~Attendee.badge_status.in_([c.INVALID_GROUP_STATUS, c.INVALID_STATUS, 
+                    ~Attendee.badge_status.in_([c.INVALID_GROUP_STATUS, c.INVALID_STATUS,
                                                 c.IMPORTED_STATUS, c.REFUNDED_STATUS])).count()
         return count
 
@@ -132,19 +343,16 @@ class ExtraConfig:
 
         return opts
 
+    @request_cached_property
+    def PREREG_CART_CONTEXT(self):
+        return PreregCartContext()
+
     @request_cached_property
     @dynamic
     def OFFER_PIT_BADGE(self):
-        from uber.models import Session
-        from uber.payments import PreregCart
-
-        with Session() as session:
-            account = session.current_attendee_account()
-            cart = PreregCart(listify(PreregCart.unpaid_preregs.values()))
-            pit_in_cart = any([a for a in cart.attendees if a.badge_type == c.PARENT_IN_TOW_BADGE])
-            paid_minors_in_cart = any([a for a in cart.attendees if a.birthdate and a.age_now_or_at_con < 18 \
-                                       and a.total_cost_if_valid])
-            return account.pit_eligible and not pit_in_cart or (not account.pit_badge and not pit_in_cart and paid_minors_in_cart)
+        pit_eligible, has_pit_badge = self.PREREG_CART_CONTEXT.account_pit_status()
+        pit_in_cart, paid_minors_in_cart = self.PREREG_CART_CONTEXT.cart_pit_status()
+        return pit_eligible and not pit_in_cart or (not has_pit_badge and not pit_in_cart and paid_minors_in_cart)
 
     @request_cached_property
     @dynamic
@@ -230,6 +438,19 @@ class ExtraConfig:
 c.TERMINAL_ID_TABLE = {k.lower().replace('-', ''): v for k, v in config['secret']['terminal_ids'].items()}
 
 
+# {ribbon: bit} for Attendee.ribbon_mask. A ribbon given a bit that's already in use is left out, so it's
+# matched on the ribbon column rather than against the other ribbon's bit.
+c.RIBBON_MASK_BITS = {}
+for ribbon_name, bit in config['ribbon_mask_bits'].items():
+    ribbon = getattr(c, ribbon_name.upper(), None)
+    if ribbon is None:
+        log.warning(f"[ribbon_mask_bits] has a bit for {ribbon_name}, which isn't a configured ribbon")
+    elif 1 << bit in c.RIBBON_MASK_BITS.values():
+        log.error(f"[ribbon_mask_bits] gives {ribbon_name} a bit already in use; it will be matched without one")
+    else:
+        c.RIBBON_MASK_BITS[ribbon] = 1 << bit
+
+
 c.STATIC_HASH_LIST = {
     "event-calendar-3.10.0/event-calendar.min.css": "sha384-zcMzrCn3tko0rjfn1phLCbrScAW3/p/W2kw2aBzAfNtBA5UnPD3KYGcuHEOi1jhD",
     "event-calendar-3.10.0/event-calendar.min.js": "sha384-S/xAtpbPjIhrLGJCIaLVoFf9BbNNoe+qAAJ7+kbkyKkNFZxSO5Dwof6orDCBTyYk",
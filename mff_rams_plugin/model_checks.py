@@ -1,7 +1,10 @@
-import re
-
 from datetime import date
+from functools import lru_cache, wraps
 from pockets import classproperty
+from residue import CoerceUTF8
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session as SASession
+from sqlalchemy.types import String
 from wtforms import validators
 from wtforms.validators import ValidationError, StopValidation
 
@@ -10,41 +13,115 @@ from uber.config import c
 from uber.decorators import prereg_validation, validation
 
 
+# Codepoints (inclusive ranges) that we refuse to store in text fields
+EMOJI_RANGES = (
+    (0x231A, 0x231B), (0x23E9, 0x23EC), (0x23F0, 0x23F0), (0x23F3, 0x23F3), (0x25FD, 0x25FE),
+    (0x2614, 0x2615), (0x2648, 0x2653), (0x267F, 0x267F), (0x2693, 0x2693), (0x26A1, 0x26A1),
+    (0x26AA, 0x26AB), (0x26BD, 0x26BE), (0x26C4, 0x26C5), (0x26CE, 0x26CE), (0x26D4, 0x26D4),
+    (0x26EA, 0x26EA), (0x26F2, 0x26F3), (0x26F5, 0x26F5), (0x26FA, 0x26FA), (0x26FD, 0x26FD),
+    (0x2705, 0x2705), (0x270A, 0x270B), (0x2728, 0x2728), (0x274C, 0x274C), (0x274E, 0x274E),
+    (0x2753, 0x2755), (0x2757, 0x2757), (0x2795, 0x2797), (0x27B0, 0x27B0), (0x27BF, 0x27BF),
+    (0x2B1B, 0x2B1C), (0x2B50, 0x2B50), (0x2B55, 0x2B55), (0x1F004, 0x1F004), (0x1F0CF, 0x1F0CF),
+    (0x1F18E, 0x1F18E), (0x1F191, 0x1F19A), (0x1F201, 0x1F201), (0x1F21A, 0x1F21A), (0x1F22F, 0x1F22F),
+    (0x1F232, 0x1F236), (0x1F238, 0x1F23A), (0x1F250, 0x1F251), (0x1F300, 0x1F320), (0x1F32D, 0x1F335),
+    (0x1F337, 0x1F37C), (0x1F37E, 0x1F393), (0x1F3A0, 0x1F3CA), (0x1F3CF, 0x1F3D3), (0x1F3E0, 0x1F3F0),
+    (0x1F3F4, 0x1F3F4), (0x1F3F8, 0x1F43E), (0x1F440, 0x1F440), (0x1F442, 0x1F4FC), (0x1F4FF, 0x1F53D),
+    (0x1F54B, 0x1F54E), (0x1F550, 0x1F567), (0x1F595, 0x1F596), (0x1F5FB, 0x1F64F), (0x1F680, 0x1F6C5),
+    (0x1F6CC, 0x1F6CC), (0x1F6D0, 0x1F6D0), (0x1F6EB, 0x1F6EC), (0x1F910, 0x1F918), (0x1F980, 0x1F984),
+    (0x1F9C0, 0x1F9C0),
+)
+
+# Flags are a pair of regional indicator symbols, which are only emoji when they appear together
+FLAG_FIRST_CHARS = frozenset(map(chr, range(0x1F1E6, 0x1F1FC + 1)))
+FLAG_SECOND_CHARS = frozenset(map(chr, range(0x1F1E6, 0x1F1FF + 1)))
+
+EMOJI_CHARS = frozenset(chr(codepoint) for start, end in EMOJI_RANGES for codepoint in range(start, end + 1))
+
+
+def contains_emoji(text):
+    if not text or text.isascii():
+        return False
+
+    if not EMOJI_CHARS.isdisjoint(text):
+        return True
+
+    if FLAG_FIRST_CHARS.isdisjoint(text):
+        return False
+
+    return any(first in FLAG_FIRST_CHARS and second in FLAG_SECOND_CHARS for first, second in zip(text, text[1:]))
+
+
+@lru_cache(maxsize=None)
+def text_column_names(table):
+    return tuple(column.key for column in table.columns if isinstance(column.type, (CoerceUTF8, String)))
+
+
+# Key in Session.info for the models flushed earlier in the current transaction, mapped to the columns that
+# changed (or None if the model was new), so an autoflush before validation doesn't hide those changes
+FLUSHED_CHANGES = 'mff_flushed_changes'
+
+
+@event.listens_for(SASession, 'before_flush')
+def record_flushed_changes(session, flush_context, instances):
+    flushed = session.info.setdefault(FLUSHED_CHANGES, {})
+    for model in session.new:
+        flushed[inspect(model)] = None
+    for model in session.dirty:
+        state = inspect(model)
+        if state.committed_state and flushed.get(state, ()) is not None:
+            flushed[state] = flushed.get(state, set()) | set(state.committed_state)
+
+
+@event.listens_for(SASession, 'after_commit')
+@event.listens_for(SASession, 'after_rollback')
+def discard_flushed_changes(session):
+    session.info.pop(FLUSHED_CHANGES, None)
+
+
+def new_or_changed_fields(model, field_names):
+    """
+    Returns the subset of field_names that may hold unvalidated data: all of them for a new model,
+    otherwise only the ones that have changed since it was loaded, including changes already flushed.
+    """
+    if model.is_new:
+        return field_names
+
+    state = inspect(model)
+    flushed = state.session.info.get(FLUSHED_CHANGES, {}).get(state, set()) if state.session else set()
+    if flushed is None:
+        return field_names
+
+    unmodified = state.unmodified_intersection(field_names)
+    return [name for name in field_names if name not in unmodified or name in flushed]
+
+
+def only_new_or_changed(*field_names):
+    """
+    Lets a validation skip existing models when none of the fields it checks have changed,
+    so re-saving a model after editing one field doesn't re-run every unrelated check.
+    Must be applied below the @validation decorators.
+    """
+    def decorator(func):
+        @wraps(func)
+        def with_check(model):
+            if new_or_changed_fields(model, field_names):
+                return func(model)
+        return with_check
+    return decorator
+
+
 @validation.Attendee
 @validation.Group
 @validation.ArtShowApplication
 def no_emojis(model):
-    for column in model.__table__.columns:
-        emojis = re.compile(
-            r'([\U0000231A-\U0000231B]|[\U000023E9-\U000023EC]|\U000023F0'
-            r'|\U000023F3|[\U000025FD-\U000025FE]|[\U00002614-\U00002615]'
-            r'|[\U00002648-\U00002653]|\U0000267F|\U00002693|\U000026A1'
-            r'|[\U000026AA-\U000026AB]|[\U000026BD-\U000026BE]'
-            r'|[\U000026C4-\U000026C5]|\U000026CE|\U000026D4|\U000026EA'
-            r'|[\U000026F2-\U000026F3]|\U000026F5|\U000026FA|\U000026FD'
-            r'|\U00002705|[\U0000270A-\U0000270B]|\U00002728|\U0000274C'
-            r'|\U0000274E|[\U00002753-\U00002755]|\U00002757'
-            r'|[\U00002795-\U00002797]|\U000027B0|\U000027BF'
-            r'|[\U00002B1B-\U00002B1C]|\U00002B50|\U00002B55|\U0001F004'
-            r'|\U0001F0CF|\U0001F18E|[\U0001F191-\U0001F19A]|\U0001F201'
-            r'|\U0001F21A|\U0001F22F|[\U0001F232-\U0001F236]'
-            r'|[\U0001F238-\U0001F23A]|[\U0001F250-\U0001F251]'
-            r'|[\U0001F300-\U0001F320]|[\U0001F32D-\U0001F335]'
-            r'|[\U0001F337-\U0001F37C]|[\U0001F37E-\U0001F393]'
-            r'|[\U0001F3A0-\U0001F3CA]|[\U0001F3CF-\U0001F3D3]'
-            r'|[\U0001F3E0-\U0001F3F0]|\U0001F3F4|[\U0001F3F8-\U0001F43E]'
-            r'|\U0001F440|[\U0001F442-\U0001F4FC]|[\U0001F4FF-\U0001F53D]'
-            r'|[\U0001F54B-\U0001F54E]|[\U0001F550-\U0001F567]'
-            r'|[\U0001F595-\U0001F596]|[\U0001F5FB-\U0001F64F]'
-            r'|[\U0001F680-\U0001F6C5]|\U0001F6CC|\U0001F6D0'
-            r'|[\U0001F6EB-\U0001F6EC]|[\U0001F910-\U0001F918]'
-            r'|[\U0001F980-\U0001F984]|\U0001F9C0'
-            r'|[\U0001F1E6-\U0001F1FC][\U0001F1E6-\U0001F1FF])')
-        if re.search(emojis, str(getattr(model, column.name))):
+    for name in new_or_changed_fields(model, text_column_names(model.__table__)):
+        value = getattr(model, name)
+        if isinstance(value, str) and contains_emoji(value):
             return ('', 'Fields cannot contain emoji.')
 
 
 @validation.Group
+@only_new_or_changed('status', 'auto_recalc', 'power', 'power_fee')
 def no_approval_without_power_fee(group):
     if group.status == c.APPROVED and group.auto_recalc and not group.power_fee and group.default_power_fee == None:
         return "Please set a power fee. To provide free power, turn off automatic recalculation."
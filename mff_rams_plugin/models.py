@@ -1,55 +1,61 @@
 import math
-from datetime import timedelta
+from uuid import uuid4
+from datetime import date, datetime, time, timedelta
 from markupsafe import Markup
-from residue import CoerceUTF8 as UnicodeText
+from residue import CoerceUTF8 as UnicodeText, UUID
 from pockets import cached_classproperty, classproperty
 from pockets.autolog import log
-from sqlalchemy import and_, or_, not_
-from sqlalchemy.types import Boolean, Integer, Numeric
-from sqlalchemy.ext.hybrid import hybrid_property
-
-from uber.models import Session
-from uber.badge_funcs import get_real_badge_type
+from pytz import UTC
+from sqlalchemy import and_, or_, not_, bindparam, event, func, inspect, select, ForeignKey, Index, UniqueConstraint
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import backref, relationship
+from sqlalchemy.orm import Session as SASession
+from sqlalchemy.sql.expression import case, FunctionElement, literal
+from sqlalchemy.types import Boolean, Date, DateTime, Integer, Numeric
+from sqlalchemy.ext.hybrid import hybrid_method, hybrid_property
+
+from uber.models import BadgeInfo, MagModel, Session, SignedDocument
 from uber.config import c
 from uber.utils import add_opt, localized_now, localize_datetime, remove_opt, normalize_email_legacy
 from uber.models.types import Choice, DefaultColumn as Column, MultiChoice
 from uber.decorators import presave_adjustment
-from uber.tasks.registration import update_receipt
-from .tasks import check_pit_badge
+from .config import badge_inventory, registration_velocity
+from .tasks import queue_after_commit, queue_pit_badge_check, update_daily_registrations, update_need_not_pay_receipts
+
+
+uber_current_attendee_account = Session.SessionMixin.current_attendee_account
 
 
 @Session.model_mixin
 class SessionMixin:
+    def current_attendee_account(self):
+        account = uber_current_attendee_account(self)
+        if 'preregistration' in c.PAGE_PATH:
+            # So c.OFFER_PIT_BADGE can work out the account's PIT status with the handler's session, if it's needed
+            c.PREREG_CART_CONTEXT.set_account(account)
+        return account
+
     def all_panelists(self):
         return self.query(Attendee).filter(or_(
-            Attendee.ribbon.contains(c.PANELIST_RIBBON),
-            Attendee.ribbon == c.STAFF_RIBBON,
+            Attendee.has_ribbon(c.PANELIST_RIBBON),
+            Attendee.ribbon == str(c.STAFF_RIBBON),
             Attendee.badge_type == c.GUEST_BADGE))\
             .order_by(Attendee.full_name).all()
 
     def update_badge(self, attendee):
-        from uber.badge_funcs import needs_badge_num
-
-        if attendee.checked_in:
-            return
-
-        badge_type = c.STAFF_BADGE if c.STAFF_RIBBON in attendee.ribbon_ints else get_real_badge_type(attendee.badge_type)
-        lower_bound, upper_bound = c.BADGE_RANGES[badge_type]
-
-        if attendee.active_badge and attendee.active_badge.attendee_id:
-            if lower_bound <= attendee.badge_num <= upper_bound:
-                return
-            attendee.active_badge.unassign()
-            self.add(attendee.active_badge)
-        
-        if needs_badge_num(attendee):
-            new_badge = self.get_next_badge_num(badge_type)
+        self.update_badges([attendee])
 
-            if not new_badge:
-                return
+    def update_badges(self, attendees):
+        from .badge_numbers import badge_numbers
+        badge_numbers.update_badges(self, attendees)
 
-            new_badge.assign(attendee.id)
-            self.add(new_badge)
+    def dealer_groups(self, *statuses):
+        query = self.query(Group).filter(Group.is_dealer == True)  # noqa: E712
+        if statuses:
+            query = query.filter(Group.status.in_(statuses))
+        return query
 
 
 @Session.model_mixin
@@ -107,6 +113,14 @@ class Group:
         else:
             self.power_fee = int(self.power_fee)
 
+    @presave_adjustment
+    def queue_daily_registration_update(self):
+        # Whether badges paid by the group count as registrations depends on the group's cost
+        if not self.is_new and self.cost != self.orig_value_of('cost'):
+            queue_after_commit(self.session, update_daily_registrations,
+                               {registration_day(a.registered).isoformat() for a in self.attendees
+                                if a.paid == c.PAID_BY_GROUP})
+
     @presave_adjustment
     def float_table_to_int(self):
         # Fix some data weirdness with prior year groups
@@ -129,20 +143,40 @@ class Group:
         session.assign_badges(self, new_badges_count)
 
     @property
+    def dealer_terms_signed(self):
+        # When the group's earliest signed document was created, the same one dealer_payment_due's expression uses
+        if self.session and self.id:
+            return self.session.query(func.min(SignedDocument.created)).filter(
+                SignedDocument.fk_id == self.id, SignedDocument.model == 'Group').scalar()
+
+    @hybrid_property
     def dealer_payment_due(self):
         if self.approved:
-            if c.SIGNNOW_DEALER_FOLDER_ID or self.terms_conditions_doc:
-                if not self.terms_conditions_doc:
+            terms_signed = self.dealer_terms_signed
+            if c.SIGNNOW_DEALER_FOLDER_ID or terms_signed:
+                if not terms_signed:
                     return
-                return self.terms_conditions_doc.created + timedelta(c.DEALER_PAYMENT_DAYS)
+                return terms_signed + timedelta(c.DEALER_PAYMENT_DAYS)
             else:
                 return self.approved + timedelta(c.DEALER_PAYMENT_DAYS)
 
-    @property
+    @dealer_payment_due.expression
+    def dealer_payment_due(cls):
+        terms_signed = select(func.min(SignedDocument.created)).where(
+            SignedDocument.fk_id == cls.id, SignedDocument.model == 'Group').scalar_subquery()
+        payment_clock_start = terms_signed if c.SIGNNOW_DEALER_FOLDER_ID else func.coalesce(terms_signed, cls.approved)
+        return case((cls.approved == None, None),  # noqa: E711
+                    else_=DatePlusDays(payment_clock_start, c.DEALER_PAYMENT_DAYS))
+
+    @hybrid_property
     def dealer_payment_is_late(self):
         if self.dealer_payment_due:
             return localized_now() > localize_datetime(self.dealer_payment_due)
 
+    @dealer_payment_is_late.expression
+    def dealer_payment_is_late(cls):
+        return cls.dealer_payment_due < datetime.now(UTC)
+
     @presave_adjustment
     def dealers_add_badges(self):
         if self.is_dealer and self.is_new:
@@ -205,6 +239,10 @@ class Group:
         return os.path.join(c.UPLOADED_FILES_DIR, c.GROUPS_TABLE_PHOTOS_DIR, str(self.id))
 
 
+# Dealer reports and emails filter on status constantly, especially while applications are open
+Index('ix_group_status', Group.status)
+
+
 @Session.model_mixin
 class ArtistMarketplaceApplication:
     MATCHING_DEALER_FIELDS = ['email_address', 'website', 'name', 'tax_number']
@@ -213,6 +251,7 @@ class ArtistMarketplaceApplication:
 @Session.model_mixin
 class Attendee:
     consent_form_email = Column(UnicodeText)
+    ribbon_mask = Column(Integer, default=0, admin_only=True)  # Only for has_ribbon in SQL; see sync_ribbon_mask
     comped_reason = Column(UnicodeText, default='', admin_only=True)
     fursuiting = Column(Boolean, default=False)
     accessibility_requests = Column(MultiChoice(c.ACCESSIBILITY_SERVICE_OPTS))
@@ -231,21 +270,83 @@ class Attendee:
 
     @presave_adjustment
     def save_group_cost(self):
+        # Recalculated once per group in recalculate_group_costs, no matter how many of its attendees changed
         if self.group and self.group.auto_recalc and not self.is_new:
-            try:
-                self.group.cost = self.group.calc_default_cost()
-            except Exception:
-                log.exception("Problem when saving group cost from save_group_cost!")
+            self.session.info.setdefault(GROUPS_NEEDING_COST, set()).add(self.group)
+
+    @presave_adjustment
+    def invalidate_badge_inventory(self):
+        badge_types = {self.badge_type, self.orig_value_of('badge_type')}
+        if badge_types.isdisjoint(c.BADGE_TYPE_PRICES):
+            return
+
+        if self.is_new or len(badge_types) > 1 or self.badge_status != self.orig_value_of('badge_status'):
+            # Cleared once this commits, so nobody can cache counts from before the change in the meantime
+            self.session.info[BADGE_INVENTORY_CHANGED] = True
+
+    @presave_adjustment
+    def queue_daily_registration_update(self):
+        changed = self.is_new or any(getattr(self, name) != self.orig_value_of(name)
+                                     for name in ['badge_status', 'paid', 'group_id', 'registered'])
+        if not changed:
+            return
+
+        # Only attendees who count (or used to count) as a registration can change a day's count
+        statuses = {self.badge_status, self.orig_value_of('badge_status')}
+        payments = {self.paid, self.orig_value_of('paid')}
+        if c.COMPLETED_STATUS in statuses or c.PAID_BY_GROUP in payments:
+            queue_after_commit(self.session, update_daily_registrations,
+                               {registration_day(self.registered).isoformat(),
+                                registration_day(self.orig_value_of('registered')).isoformat()})
+
+    @presave_adjustment
+    def record_registration_velocity(self):
+        if self.badge_status != c.COMPLETED_STATUS:
+            return
+
+        # Bucket by registered time, like RegistrationVelocity's windowed query does
+        registered = self.registered or datetime.now(UTC)
+        when = registered if registered.tzinfo else registered.replace(tzinfo=UTC)
+        pending = self.session.info.setdefault(PENDING_REGISTRATION_VELOCITY, [])
+
+        newly_completed = self.is_new or self.orig_value_of('badge_status') != c.COMPLETED_STATUS
+        if newly_completed:
+            pending.append((None, when))
+        if self.badge_type in c.BADGE_TYPE_PRICES and (newly_completed
+                                                        or self.badge_type != self.orig_value_of('badge_type')):
+            pending.append((self.badge_type, when))
+
+    @presave_adjustment
+    def sync_accessibility_request_rows(self):
+        if not self.is_new and self.accessibility_requests == self.orig_value_of('accessibility_requests'):
+            return
+
+        services = set(self.accessibility_requests_ints)
+        for row in list(self.accessibility_request_rows):
+            if row.service not in services:
+                self.accessibility_request_rows.remove(row)
+        for service in services.difference(row.service for row in self.accessibility_request_rows):
+            self.accessibility_request_rows.append(AttendeeAccessibilityRequest(service=service))
 
     @presave_adjustment
     def never_spam(self):
         self.can_spam = False
 
+    @presave_adjustment
+    def invalidate_pit_eligibility(self):
+        managers = inspect(self).attrs.managers.history
+        if self.is_new or managers.has_changes() or any(getattr(self, name) != self.orig_value_of(name)
+                                                        for name in ['badge_type', 'badge_status', 'paid', 'birthdate']):
+            for account in set(self.managers).union(managers.deleted or ()):
+                account.invalidate_pit_eligibility()
+            if 'preregistration' in c.PAGE_PATH:
+                c.PREREG_CART_CONTEXT.invalidate()
+
     @presave_adjustment
     def check_pit_badge(self):
         if self.birthdate and self.age_now_or_at_con < 18 and self.managers and \
                 self.badge_status != self.orig_value_of('badge_status'):
-            check_pit_badge.delay(self.id)
+            queue_pit_badge_check(self.session, self.managers)
 
     @presave_adjustment
     def kid_in_tow_badge(self):
@@ -253,14 +354,17 @@ class Attendee:
                 self.badge_type == c.ATTENDEE_BADGE or self.attendance_type == c.SINGLE_DAY):
             self.badge_type = c.KID_IN_TOW_BADGE
 
+    def queue_need_not_pay_receipt_update(self):
+        # Only when paid actually changes, and only once per transaction no matter how many adjustments ask
+        if not self.is_new and self.orig_value_of('paid') != c.NEED_NOT_PAY:
+            queue_after_commit(self.session, update_need_not_pay_receipts, {self.id})
+
     @presave_adjustment
     def not_attending_need_not_pay(self):
         if self.badge_status == c.NOT_ATTENDING:
             self.paid = c.NEED_NOT_PAY
             self.comped_reason = "Automated: Not Attending badge status."
-
-            if not self.is_new:
-                update_receipt(self.id, {'paid': c.NEED_NOT_PAY})
+            self.queue_need_not_pay_receipt_update()
 
     @presave_adjustment
     def in_tow_need_not_pay(self):
@@ -269,8 +373,8 @@ class Attendee:
 
             if self.is_new and self.badge_status == c.PENDING_STATUS:
                 self.badge_status == c.COMPLETE
-            elif not self.is_new:
-                update_receipt(self.id, {'paid': c.NEED_NOT_PAY})
+            else:
+                self.queue_need_not_pay_receipt_update()
 
     def calculate_badge_cost(self, use_promo_code=False, include_price_override=True):
         # Adds overrides for a couple special cases where a badge should be free
@@ -293,14 +397,14 @@ class Attendee:
 
     @presave_adjustment
     def staffing_badge_and_ribbon_adjustments(self):
-        if self.badge_type == c.STAFF_BADGE or c.STAFF_RIBBON in self.ribbon_ints:
+        if self.badge_type == c.STAFF_BADGE or self.has_ribbon(c.STAFF_RIBBON):
             self.ribbon = remove_opt(self.ribbon_ints, c.VOLUNTEER_RIBBON)
 
         elif self.staffing and self.badge_type != c.STAFF_BADGE \
-                and c.STAFF_RIBBON not in self.ribbon_ints and c.VOLUNTEER_RIBBON not in self.ribbon_ints:
+                and not self.has_ribbon(c.STAFF_RIBBON) and not self.has_ribbon(c.VOLUNTEER_RIBBON):
             self.ribbon = add_opt(self.ribbon_ints, c.VOLUNTEER_RIBBON)
 
-        if self.badge_type == c.STAFF_BADGE or c.STAFF_RIBBON in self.ribbon_ints:
+        if self.badge_type == c.STAFF_BADGE or self.has_ribbon(c.STAFF_RIBBON):
             self.staffing = True
             if not self.overridden_price and self.paid in [c.NOT_PAID, c.PAID_BY_GROUP]:
                 self.paid = c.NEED_NOT_PAY
@@ -321,7 +425,7 @@ class Attendee:
 
         old_type = self.orig_value_of('badge_type')
 
-        if (old_type != self.badge_type and c.STAFF_RIBBON not in self.ribbon_ints) or needs_badge_num(self) and not self.badge_num:
+        if (old_type != self.badge_type and not self.has_ribbon(c.STAFF_RIBBON)) or needs_badge_num(self) and not self.badge_num:
             self.session.update_badge(self)
 
     def cc_emails_for_ident(self, ident=''):
@@ -526,36 +630,399 @@ class Attendee:
     def has_personalized_badge(self):
         return True
 
-    @property
+    @hybrid_method
+    def has_ribbon(self, ribbon):
+        return ribbon in self.ribbon_ints
+
+    @has_ribbon.expression
+    def has_ribbon(cls, ribbon):
+        bit = c.RIBBON_MASK_BITS.get(ribbon)
+        if bit is None:
+            ribbon = str(ribbon)
+            return or_(cls.ribbon == ribbon, cls.ribbon.startswith(ribbon + ','), cls.ribbon.endswith(',' + ribbon),
+                       cls.ribbon.contains(',' + ribbon + ','))
+        return cls.ribbon_mask.op('&')(bit) != 0
+
+    @hybrid_property
     def staff_hotel_lottery_eligible(self):
-        return self.badge_type == c.STAFF_BADGE or c.STAFF_RIBBON in self.ribbon_ints
+        return self.badge_type == c.STAFF_BADGE or self.has_ribbon(c.STAFF_RIBBON)
+
+    @staff_hotel_lottery_eligible.expression
+    def staff_hotel_lottery_eligible(cls):
+        return or_(cls.badge_type == c.STAFF_BADGE, cls.has_ribbon(c.STAFF_RIBBON))
+
+    @hybrid_property
+    def dealer_hotel_lottery_eligible(self):
+        return bool(self.is_dealer) and self.badge_status != c.UNAPPROVED_DEALER_STATUS
+
+    @dealer_hotel_lottery_eligible.expression
+    def dealer_hotel_lottery_eligible(cls):
+        # Attendee.is_dealer's own expression needs Group joined in, so this spells it out as a subquery;
+        # test_dealer_hotel_lottery_eligible_matches_is_dealer keeps the two in step
+        return and_(or_(cls.has_ribbon(c.DEALER_RIBBON),
+                        and_(cls.paid == c.PAID_BY_GROUP, cls.group.has(Group.is_dealer == True))),  # noqa: E712
+                    cls.badge_status != c.UNAPPROVED_DEALER_STATUS)
+
+
+# The attendance graph's daily counts and the on-sale reports all look up attendees by when they registered
+Index('ix_attendee_registered', Attendee.registered)
+
+# Finding the lowest free number in a range only has to look at unassigned badges
+Index('ix_badge_info_unassigned_ident', BadgeInfo.ident,
+      postgresql_where=BadgeInfo.attendee_id == None, sqlite_where=BadgeInfo.attendee_id == None)  # noqa: E711
+
+
+@event.listens_for(SASession, 'before_flush')
+def queue_deleted_registration_days(session, flush_context, instances):
+    # Presave adjustments don't run for deleted attendees, so recount the days they were counted in here
+    days = {registration_day(attendee.registered).isoformat() for attendee in session.deleted
+            if isinstance(attendee, Attendee) and (attendee.badge_status == c.COMPLETED_STATUS
+                                                   or attendee.paid == c.PAID_BY_GROUP)}
+    if days:
+        queue_after_commit(session, update_daily_registrations, days)
+
+
+@event.listens_for(Attendee.ribbon, 'set')
+def sync_ribbon_mask(attendee, ribbon, oldvalue, initiator):
+    # Writes that skip the ORM (e.g., query .update() or imports) leave the mask stale until
+    # `sep backfill_ribbon_masks` or `sep resync_badges` runs
+    ribbon_ints = ribbon_ints_of(ribbon) if isinstance(ribbon, str) else [int(i) for i in ribbon or []]
+    attendee.ribbon_mask = ribbon_mask_of(ribbon_ints)
+
+
+# Key in Session.info set when this transaction changes upgrade badge counts
+BADGE_INVENTORY_CHANGED = 'mff_badge_inventory_changed'
+
+
+@event.listens_for(SASession, 'after_commit')
+def invalidate_badge_inventory_after_commit(session):
+    if session.info.pop(BADGE_INVENTORY_CHANGED, False):
+        badge_inventory.invalidate()
+
+
+@event.listens_for(SASession, 'after_rollback')
+def discard_badge_inventory_change(session):
+    session.info.pop(BADGE_INVENTORY_CHANGED, None)
+
+
+# Key in Session.info for the (badge type, registered) pairs to count towards registration velocity on commit
+PENDING_REGISTRATION_VELOCITY = 'mff_pending_registration_velocity'
+
+
+@event.listens_for(SASession, 'after_commit')
+def record_registration_velocity_after_commit(session):
+    for badge_type, when in session.info.pop(PENDING_REGISTRATION_VELOCITY, ()):
+        registration_velocity.record(badge_type, when)
+
+
+@event.listens_for(SASession, 'after_rollback')
+def discard_registration_velocity(session):
+    session.info.pop(PENDING_REGISTRATION_VELOCITY, None)
+
+
+# Key in Session.info for the auto-recalc groups whose attendees changed since the last flush
+GROUPS_NEEDING_COST = 'mff_groups_needing_cost'
+
+
+@event.listens_for(SASession, 'before_flush')
+def recalculate_group_costs(session, flush_context, instances):
+    for group in session.info.pop(GROUPS_NEEDING_COST, ()):
+        if group.auto_recalc and group in session:
+            try:
+                cost = group.calc_default_cost()
+            except Exception:
+                log.exception("Problem when saving group cost from save_group_cost!")
+                continue
+
+            if cost != group.cost:
+                group.cost = cost
+                # The group's own presave adjustments may already have run for this flush
+                group.queue_daily_registration_update()
+
+
+@event.listens_for(SASession, 'after_rollback')
+def discard_groups_needing_cost(session):
+    session.info.pop(GROUPS_NEEDING_COST, None)
+
+
+class PitEligibility:
+    """
+    Everything we need to know about an account's minors to decide whether it may have an
+    accompanying adult (parent-in-tow) badge, computed in one pass over the account's attendees.
+    """
+    def __init__(self, account):
+        self.pit_badge = None
+        self.paid_minors = []
+        self.pending_minors = []
+
+        for attendee in account.valid_attendees:
+            if attendee.badge_type == c.PARENT_IN_TOW_BADGE:
+                self.pit_badge = self.pit_badge or attendee
+            elif attendee.birthdate and attendee.age_now_or_at_con < 18 and attendee.badge_cost \
+                    and attendee.is_paid and attendee.badge_status != c.NOT_ATTENDING:
+                self.paid_minors.append(attendee)
+
+        if not self.pit_badge:
+            for attendee in account.pending_attendees:
+                if attendee.badge_type == c.PARENT_IN_TOW_BADGE:
+                    self.pit_badge = attendee
+                    break
+
+        for attendee in account.attendees:
+            if (attendee.badge_status == c.PENDING_STATUS or attendee.paid == c.PENDING) and \
+                    attendee.birthdate and attendee.age_now_or_at_con < 18:
+                self.pending_minors.append(attendee)
+
+    @property
+    def pit_eligible(self):
+        return self.paid_minors and not self.pit_badge
 
 
 @Session.model_mixin
 class AttendeeAccount:
+    @property
+    def pit_eligibility(self):
+        # Cleared by the Attendee.invalidate_pit_eligibility presave adjustment when one of our attendees changes
+        if getattr(self, '_pit_eligibility', None) is None:
+            self._pit_eligibility = PitEligibility(self)
+        return self._pit_eligibility
+
+    def invalidate_pit_eligibility(self):
+        self._pit_eligibility = None
+
     @property
     def pit_badge(self):
-        for attendee in self.valid_attendees + self.pending_attendees:
-            if attendee.badge_type == c.PARENT_IN_TOW_BADGE:
-                return attendee
+        return self.pit_eligibility.pit_badge
 
     @property
     def pit_eligible(self):
-        return self.paid_minors and not self.pit_badge
-    
+        return self.pit_eligibility.pit_eligible
+
     @property
     def paid_minors(self):
-        paid_minors = []
-        for minor in [a for a in self.valid_attendees if a.birthdate and a.age_now_or_at_con < 18]:
-            if minor.badge_cost and minor.is_paid and minor.badge_status != c.NOT_ATTENDING:
-                paid_minors.append(minor)
-        return paid_minors
+        return self.pit_eligibility.paid_minors
 
     @property
     def hotel_eligible_dealers(self):
-        return [attendee for attendee in self.hotel_eligible_attendees if attendee.is_dealer and
-                attendee.badge_status != c.UNAPPROVED_DEALER_STATUS]
+        return [attendee for attendee in self.hotel_eligible_attendees if attendee.dealer_hotel_lottery_eligible]
 
     @property
     def hotel_eligible_staff(self):
-        return [a for a in self.hotel_eligible_attendees if a.badge_type == c.STAFF_BADGE or c.STAFF_RIBBON in a.ribbon_ints]
\ No newline at end of file
+        return [attendee for attendee in self.hotel_eligible_attendees if attendee.staff_hotel_lottery_eligible]
+
+    @classmethod
+    def has_hotel_eligible_non_staff(cls):
+        """
+        Filter for accounts with a valid attendee who isn't eligible for the staff hotel lottery, i.e., accounts
+        that may need the regular hotel lottery instructions. This is a superset of the accounts where
+        hotel_eligible_attendees has anyone not in hotel_eligible_staff, since hotel lottery eligibility
+        also requires a valid badge.
+        """
+        return cls.attendees.any(and_(Attendee.is_valid == True,  # noqa: E712
+                                      not_(Attendee.staff_hotel_lottery_eligible)))
+
+
+class DailyRegistrationCount(MagModel):
+    """
+    How many paid registrations were taken each day, kept up to date as attendees change so the
+    attendance graph doesn't have to aggregate the whole attendee table on every page load.
+    """
+    day = Column(Date, unique=True)
+    count = Column(Integer, default=0)
+
+
+class AttendeeAccessibilityRequest(MagModel):
+    """
+    One row per accessibility service each attendee requested, mirroring Attendee.accessibility_requests
+    so attendees can be filtered by service with an index instead of a LIKE over every attendee.
+    """
+    attendee_id = Column(UUID, ForeignKey('attendee.id', ondelete='cascade'))
+    attendee = relationship('Attendee', backref=backref('accessibility_request_rows', cascade='all,delete-orphan',
+                                                        passive_deletes=True))
+    service = Column(Choice(c.ACCESSIBILITY_SERVICE_OPTS))
+
+    __table_args__ = (
+        UniqueConstraint('attendee_id', 'service'),
+        Index('ix_attendee_accessibility_request_service', 'service', 'attendee_id'),
+    )
+
+
+class DatePlusDays(FunctionElement):
+    """
+    A datetime expression plus a whole number of days, since SQLite can't add intervals.
+    """
+    type = DateTime()
+    name = 'date_plus_days'
+    inherit_cache = True
+
+
+@compiles(DatePlusDays)
+def compile_date_plus_days(element, compiler, **kw):
+    when, days = element.clauses
+    return f"({compiler.process(when, **kw)} + make_interval(days => {compiler.process(days, **kw)}))"
+
+
+@compiles(DatePlusDays, 'sqlite')
+def compile_date_plus_days_sqlite(element, compiler, **kw):
+    when, days = element.clauses
+    return f"datetime({compiler.process(when, **kw)}, '+' || {compiler.process(days, **kw)} || ' days')"
+
+
+def has_accessibility_request_rows(*services):
+    """
+    Filter for attendees with an AttendeeAccessibilityRequest row for any of the given services, or for any
+    service at all. Attendees can set requested_accessibility_services without choosing a service, so this
+    doesn't match everyone with that flag set.
+    """
+    attendee_ids = select(AttendeeAccessibilityRequest.attendee_id)
+    if services:
+        attendee_ids = attendee_ids.where(AttendeeAccessibilityRequest.service.in_(services))
+    return Attendee.id.in_(attendee_ids)
+
+
+def rebuild_accessibility_request_rows(session):
+    """
+    Rewrites every AttendeeAccessibilityRequest from Attendee.accessibility_requests, e.g., to backfill the
+    table. Returns how many rows were written.
+    """
+    session.query(AttendeeAccessibilityRequest).delete(synchronize_session=False)
+    rows = [{'attendee_id': attendee_id, 'service': int(service)}
+            for attendee_id, requests in session.query(Attendee.id, Attendee.accessibility_requests).filter(
+                Attendee.accessibility_requests != '')
+            for service in set(str(requests).split(',')) if service]
+    session.bulk_insert_mappings(AttendeeAccessibilityRequest, rows)
+    return len(rows)
+
+
+def registration_day(registered):
+    # New attendees don't have a registration time until they're inserted
+    return (registered or datetime.now(UTC)).astimezone(UTC).date()
+
+
+def counts_as_registration():
+    # Attendees who actually paid money, or were comped through a group that paid; needs Attendee.group joined
+    return ((Attendee.paid == c.PAID_BY_GROUP) & (Group.amount_paid >= Group.cost * 100)) \
+        | (Attendee.badge_status == c.COMPLETED_STATUS)
+
+
+def count_registrations_per_day(session, days=None):
+    """
+    Counts registrations where people actually paid money (or were comped through a paid group),
+    grouped by the day they registered. Returns {date: count}, optionally limited to the given days.
+    """
+    # The UTC day, like the day windows below and registration_day(), whatever the server's timezone
+    if session.bind.dialect.name == 'sqlite':
+        day_registered = func.date(Attendee.registered)
+    else:
+        day_registered = func.date(func.timezone('UTC', Attendee.registered))
+
+    query = session.query(day_registered, func.count(day_registered)).outerjoin(Attendee.group).filter(
+        counts_as_registration())
+
+    if days is not None:
+        day_starts = [datetime.combine(day, time(), tzinfo=UTC) for day in days]
+        query = query.filter(or_(*[and_(Attendee.registered >= start, Attendee.registered < start + timedelta(days=1))
+                                   for start in day_starts]))
+
+    counts = {}
+    for day, count in query.group_by(day_registered):
+        if isinstance(day, str):
+            day = date.fromisoformat(day)
+        elif isinstance(day, datetime):
+            day = day.date()
+        counts[day] = count
+    return counts
+
+
+def registered_truncated_to(session, unit):
+    # The UTC hour or minute each attendee registered in, as an expression to group by
+    if session.bind.dialect.name == 'sqlite':
+        return func.strftime({'hour': '%Y-%m-%d %H:00:00', 'minute': '%Y-%m-%d %H:%M:00'}[unit], Attendee.registered)
+    return func.date_trunc(literal(unit), func.timezone('UTC', Attendee.registered))
+
+
+def naive_utc(truncated):
+    # SQLite returns registered_truncated_to() as a string
+    if isinstance(truncated, str):
+        truncated = datetime.fromisoformat(truncated)
+    return truncated.replace(tzinfo=None)
+
+
+def count_registrations_per_hour(session, start, end):
+    """
+    Like count_registrations_per_day, but for the hours in [start, end), e.g., right after badges go on sale.
+    Returns {naive UTC datetime of the start of the hour: count}.
+    """
+    hour_registered = registered_truncated_to(session, 'hour')
+    query = session.query(hour_registered, func.count(hour_registered)).outerjoin(Attendee.group).filter(
+        counts_as_registration(), Attendee.registered >= start, Attendee.registered < end)
+
+    return {naive_utc(hour): count for hour, count in query.group_by(hour_registered)}
+
+
+def count_completed_per_minute(session, start, end):
+    """
+    Counts completed registrations in [start, end) by the minute they registered and their badge type.
+    Returns {(naive UTC datetime of the start of the minute, badge_type): count}.
+    """
+    minute_registered = registered_truncated_to(session, 'minute')
+    query = session.query(minute_registered, Attendee.badge_type, func.count(Attendee.id)).filter(
+        Attendee.badge_status == c.COMPLETED_STATUS, Attendee.registered >= start, Attendee.registered < end)
+
+    return {(naive_utc(minute), badge_type): count
+            for minute, badge_type, count in query.group_by(minute_registered, Attendee.badge_type)}
+
+
+def refresh_daily_registrations(session, days, counts=None):
+    """
+    Recounts the given days and writes them with a single upsert, so two tasks refreshing the same new
+    day can't both try to insert it. Each day's count is an index range scan on Attendee.registered.
+    """
+    if not days:
+        return
+
+    counts = count_registrations_per_day(session, days) if counts is None else counts
+    dialect_insert = sqlite_insert if session.bind.dialect.name == 'sqlite' else postgresql_insert
+    table = DailyRegistrationCount.__table__
+    statement = dialect_insert(table)
+    statement = statement.on_conflict_do_update(index_elements=[table.c.day],
+                                                set_={'count': statement.excluded['count']})
+    session.execute(statement, [{'id': str(uuid4()), 'day': day, 'count': counts.get(day, 0)} for day in days])
+
+
+def rebuild_daily_registrations(session):
+    """
+    Recounts every day that has registrations or an existing count, e.g., to backfill the table or
+    to catch group payments, which don't pass through the attendee or group presave adjustments.
+    Returns how many days were recounted.
+    """
+    counts = count_registrations_per_day(session)
+    days = set(counts).union(day for day, in session.query(DailyRegistrationCount.day))
+    refresh_daily_registrations(session, sorted(days), counts)
+    return len(days)
+
+
+def ribbon_ints_of(ribbon):
+    return [int(i) for i in (ribbon or '').split(',') if i]
+
+
+def ribbon_mask_of(ribbon_ints):
+    mask = 0
+    for ribbon in ribbon_ints:
+        mask |= c.RIBBON_MASK_BITS.get(ribbon, 0)
+    return mask
+
+
+def rebuild_ribbon_masks(session, batch_size=1000):
+    """
+    Recomputes every attendee's ribbon_mask from their ribbon column, which stays the source of truth.
+    Returns how many attendees were updated.
+    """
+    attendee_table = Attendee.__table__
+    statement = attendee_table.update().where(attendee_table.c.id == bindparam('attendee_id')).values(
+        ribbon_mask=bindparam('new_ribbon_mask'))
+    rows = [{'attendee_id': attendee_id, 'new_ribbon_mask': ribbon_mask_of(ribbon_ints_of(ribbon))}
+            for attendee_id, ribbon in session.query(Attendee.id, Attendee.ribbon)]
+    for i in range(0, len(rows), batch_size):
+        session.execute(statement, rows[i:i + batch_size])
+    return len(rows)
@@ -0,0 +1,109 @@
+import argparse
+
+from uber.decorators import entry_point
+from uber.models import Session
+
+from .badge_numbers import BadgeResync, BADGE_RESYNC_BATCH_SIZE
+from .models import rebuild_accessibility_request_rows, rebuild_daily_registrations, rebuild_ribbon_masks
+
+
+@entry_point
+def backfill_daily_registrations():
+    """
+    Recounts the daily registration totals used by the attendance graph from the attendee table.
+    Run this once after upgrading, and any time the counts look out of date.
+    """
+    with Session() as session:
+        days = rebuild_daily_registrations(session)
+        session.commit()
+    print(f"Recounted registrations for {days} days.")
+
+
+@entry_point
+def save_registration_history():
+    """
+    Saves this event's daily registration counts so future events' attendance graphs can compare
+    against them. Run this after the event ends; previous events are never queried again.
+    """
+    from .site_sections.mff_reports import RegistrationDataOneYear
+
+    with Session() as session:
+        year_data = RegistrationDataOneYear()
+        year_data.query_current_year(session)
+    print(f"Saved {year_data.event_name} registrations to {year_data.save_to_history_file()}.")
+
+
+@entry_point
+def backfill_accessibility_requests():
+    """
+    Rewrites the indexed accessibility request rows from each attendee's accessibility_requests.
+    The migration that adds the table does this once; run this if the two ever disagree.
+    """
+    with Session() as session:
+        rows = rebuild_accessibility_request_rows(session)
+        session.commit()
+    print(f"Wrote {rows} accessibility requests.")
+
+
+@entry_point
+def backfill_ribbon_masks():
+    """
+    Recomputes each attendee's ribbon bitmask from their ribbons. Run this once after upgrading, and again after
+    giving a ribbon a bit in [ribbon_mask_bits] or writing ribbons outside the ORM.
+    """
+    with Session() as session:
+        rows = rebuild_ribbon_masks(session)
+        session.commit()
+    print(f"Recomputed ribbon masks for {rows} attendees.")
+
+
+@entry_point
+def check_automated_email_prefilters():
+    """
+    Checks that no MFF automated email's query= prefilter excludes anyone its filter would email.
+    This evaluates every filter against every row, so it's slow; run it after changing a fixture.
+    """
+    from .automated_emails import MFF_EMAIL_IDENTS, prefilter_misses
+
+    failed = False
+    with Session() as session:
+        for ident in MFF_EMAIL_IDENTS:
+            try:
+                misses = prefilter_misses(session, ident)
+            except Exception as e:
+                failed = True
+                print(f"{ident}: the filter raised {e!r}, so its prefilter couldn't be checked")
+                session.rollback()
+                continue
+            if misses:
+                failed = True
+                print(f"{ident}: the prefilter excludes {len(misses)} matching rows, e.g. {misses[:5]}")
+    print("Some prefilters are too narrow or couldn't be checked." if failed else "All prefilters are OK.")
+
+
+@entry_point
+def resync_badges():
+    """
+    Brings every attendee's badge type, ribbons and badge number in line with their presave adjustments, in
+    bulk. Run this after importing ribbons or changing badge ranges; use --dry-run to see the changes first.
+    """
+    parser = argparse.ArgumentParser(prog='sep resync_badges', description=resync_badges.__doc__)
+    parser.add_argument('--dry-run', action='store_true', help='print the changes without saving them')
+    parser.add_argument('--batch-size', type=int, default=BADGE_RESYNC_BATCH_SIZE)
+    args = parser.parse_args()
+
+    with Session() as session:
+        resync = BadgeResync(session, batch_size=args.batch_size).compute()
+        for line in resync.diff_lines():
+            print(line)
+
+        if not args.dry_run:
+            resync.apply()
+            with resync.timed('commit'):
+                session.commit()
+
+    renumbered = sum(len(attendee_ids) for attendee_ids in resync.renumber.values())
+    print(f"{'Would change' if args.dry_run else 'Changed'} {len(resync.changes)} attendees: "
+          f"{len(resync.updates)} badge type or ribbon updates, {len(resync.unassign)} out-of-range badge numbers "
+          f"freed and {renumbered} badge numbers to assign.")
+    print(', '.join(f'{step} {seconds * 1000:.1f}ms' for step, seconds in resync.timings.items()))
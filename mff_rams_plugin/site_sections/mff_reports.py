@@ -1,21 +1,383 @@
+import os
+import time
+from functools import lru_cache
+
 import cherrypy
+import numpy as np
 from cherrypy.lib.static import serve_file
 from collections import defaultdict
+from datetime import datetime, timedelta
 from pockets.autolog import log
-from sqlalchemy import func
-from sqlalchemy.sql.expression import literal
+from pytz import UTC
+from sqlalchemy import case, func, or_, tuple_
+from sqlalchemy.orm import joinedload
 
 from uber.config import c
-from uber.decorators import all_renderable, csv_file, public
+from uber.decorators import ajax_gettable, all_renderable, csv_file, public
 from uber.models import Attendee, Group
 from uber.utils import localized_now
+from mff_rams_plugin.config import badge_inventory, registration_velocity
+from mff_rams_plugin.models import (AttendeeAccessibilityRequest, count_registrations_per_hour, DailyRegistrationCount,
+                                    has_accessibility_request_rows)
+
+
+def badge_status_matrix(session, badge_types):
+    """
+    Counts attendees of each of the given badge types by badge status with a single grouped query.
+    Returns {badge_type: {status_label: count}}, with every status in c.BADGE_STATUS_OPTS present.
+    """
+    status_counts = {badge_type: {desc: 0 for val, desc in c.BADGE_STATUS_OPTS} for badge_type in badge_types}
+
+    counts = session.query(Attendee.badge_type, Attendee.badge_status, func.count(Attendee.id)).filter(
+        Attendee.badge_type.in_(badge_types)).group_by(Attendee.badge_type, Attendee.badge_status)
+
+    for badge_type, badge_status, count in counts:
+        if badge_status in c.BADGE_STATUS:
+            status_counts[badge_type][c.BADGE_STATUS[badge_status]] = count
+
+    return status_counts
+
+
+def comped_badge_counts(session):
+    """
+    Counts all, claimed and unclaimed comped badges with a single conditional aggregate.
+    """
+    all_comped, claimed_comped, unclaimed_comped = session.valid_attendees().filter(
+        Attendee.paid == c.NEED_NOT_PAY).with_entities(
+            func.count(Attendee.id),
+            func.sum(case((Attendee.placeholder == False, 1), else_=0)),  # noqa: E712
+            func.sum(case((Attendee.placeholder == True, 1), else_=0))).one()  # noqa: E712
+
+    return {
+        'all_comped': all_comped,
+        'claimed_comped': claimed_comped or 0,
+        'unclaimed_comped': unclaimed_comped or 0,
+    }
+
+
+# How many comped attendees to show on each page of the comped badges report
+COMPED_BADGES_PAGE_SIZE = 100
+
+# Columns the comped badges report can be sorted by; Attendee.id is always added to break ties
+COMPED_BADGES_SORTS = {
+    'name': [Attendee.last_name, Attendee.first_name],
+    'badge_name': [Attendee.badge_printed_name],
+    'badge_type': [Attendee.badge_type],
+    'badge_num': [func.coalesce(Attendee.badge_num, 0)],
+    'claimed': [Attendee.placeholder],
+}
+
+
+def comped_badges_page(session, show='all', sort='name', search='', after=None, before=None,
+                       page_size=COMPED_BADGES_PAGE_SIZE):
+    """
+    Returns one page of comped attendees using keyset pagination: the page starts right after (or ends
+    right before) the attendee with the given id in the chosen sort order, so later pages cost the same
+    as the first. Returns (attendees, has_previous, has_next).
+    """
+    query = session.valid_attendees().filter(Attendee.paid == c.NEED_NOT_PAY)
+    if show == 'claimed':
+        query = query.filter(Attendee.placeholder == False)  # noqa: E712
+    elif show == 'unclaimed':
+        query = query.filter(Attendee.placeholder == True)  # noqa: E712
+
+    if search:
+        term = '%' + search.strip() + '%'
+        query = query.filter(or_(Attendee.first_name.ilike(term), Attendee.last_name.ilike(term),
+                                 Attendee.badge_printed_name.ilike(term), Attendee.comped_reason.ilike(term)))
+
+    sort_key = COMPED_BADGES_SORTS.get(sort, COMPED_BADGES_SORTS['name']) + [Attendee.id]
+    cursor = before or after
+    if cursor:
+        cursor_values = session.query(*sort_key).filter(Attendee.id == cursor).first()
+        if cursor_values:
+            if before:
+                query = query.filter(tuple_(*sort_key) < tuple_(*cursor_values))
+            else:
+                query = query.filter(tuple_(*sort_key) > tuple_(*cursor_values))
+
+    attendees = query.order_by(*[col.desc() for col in sort_key] if before else sort_key).limit(page_size + 1).all()
+    more = len(attendees) > page_size
+    attendees = attendees[:page_size]
+    if before:
+        attendees.reverse()
+        return attendees, more, True
+    return attendees, bool(after), more
+
+
+# (start, num_hours) -> (time.monotonic() to recount at, registrations in each hour)
+on_sale_hours_cache = {}
+
+
+def on_sale_hour_counts(session, start, num_hours):
+    """
+    Returns how many registrations were taken in each of the num_hours hours from start, which should be on
+    the hour. Counts are reused for ATTENDANCE_GRAPH_ON_SALE_CACHE_SECONDS, so loading the attendance graph
+    doesn't group the attendee table by hour every time.
+    """
+    expires, counts = on_sale_hours_cache.get((start, num_hours), (0, None))
+    if time.monotonic() < expires:
+        return counts
+
+    hourly = count_registrations_per_hour(session, start, start + timedelta(hours=num_hours))
+    hours = np.array(list(hourly), dtype='datetime64[h]')
+    hours_after_start = (hours - np.datetime64(start.replace(tzinfo=None), 'h')).astype(np.int64)
+    counts = bucket_counts(hours_after_start, list(hourly.values()), num_hours).tolist()
+
+    on_sale_hours_cache[start, num_hours] = (time.monotonic() + c.ATTENDANCE_GRAPH_ON_SALE_CACHE_SECONDS, counts)
+    return counts
+
+
+# How many dealer groups to pull from the database at a time when writing a CSV export
+DEALER_EXPORT_BATCH_SIZE = 500
+
+
+# How many attendees to pull from the database at a time when writing the accessibility report
+ACCESSIBILITY_EXPORT_BATCH_SIZE = 1000
+
+
+def accessibility_request_rows(session):
+    """
+    Streams (badge name, badge number, email, accommodation labels, other accommodations) for every attendee
+    with accessibility requests, selecting only those columns in batches rather than loading whole attendees.
+    """
+    labels = {str(service): label for service, label in c.ACCESSIBILITY_SERVICE_OPTS}
+    rows = session.query(Attendee.badge_printed_name, Attendee.badge_num, Attendee.email,
+                         Attendee.accessibility_requests, Attendee.other_accessibility_requests).filter(
+        has_accessibility_request_rows()).yield_per(ACCESSIBILITY_EXPORT_BATCH_SIZE)
+
+    for badge_name, badge_num, email, requests, other_requests in rows:
+        # MultiChoice columns are stored as comma-separated ids, which are decoded here without the type's overhead;
+        # sorted like the type's _labels, so the export matches accessibility_requests_labels
+        requests = ", ".join(sorted(labels[service] for service in str(requests).split(',') if service in labels))
+        yield badge_name, badge_num, email, requests, other_requests
+
+
+def accessibility_service_counts(session):
+    """
+    Counts valid attendees who requested each accessibility service, grouping the indexed
+    AttendeeAccessibilityRequest rows. Returns {label: count} in the order of c.ACCESSIBILITY_SERVICE_OPTS.
+    """
+    counts = dict(session.valid_attendees().join(Attendee.accessibility_request_rows).with_entities(
+        AttendeeAccessibilityRequest.service, func.count(Attendee.id)).group_by(AttendeeAccessibilityRequest.service))
+
+    return {label: counts.get(service, 0) for service, label in c.ACCESSIBILITY_SERVICE_OPTS}
+
+
+def late_dealer_groups(session, due_within_days=0):
+    """
+    Approved dealer groups which haven't paid and whose payment is overdue, or will be within the given
+    number of days, with the longest overdue first. Everything is filtered and sorted in the database.
+    """
+    return session.dealer_groups(c.APPROVED, c.SHARED).options(joinedload(Group.leader)).filter(
+        Group.amount_paid < Group.cost * 100,
+        Group.dealer_payment_due < localized_now() + timedelta(days=due_within_days)
+    ).order_by(Group.dealer_payment_due, Group.name)
 
 
 def get_dict_sum(dict_to_sum):
     return sum([dict_to_sum[key] * key for key in dict_to_sum])
 
 
+def dealer_groups_for_export(session, *statuses):
+    """
+    Streams dealer groups, optionally limited to the given statuses, in batches with their leader
+    loaded alongside them, so exports use a constant number of queries and don't hold every group
+    in memory at once.
+    """
+    return session.dealer_groups(*statuses).options(
+        joinedload(Group.leader)).yield_per(DEALER_EXPORT_BATCH_SIZE)
+
+
+def dealer_groups_with_totals_for_export(session, *statuses):
+    """
+    Like dealer_groups_for_export, but streams (group, badges, amount_paid) rows with the badge count and
+    amount paid computed by the database, since Group.badges and Group.amount_paid would otherwise load
+    each group's attendees and receipts.
+    """
+    badges = session.query(func.count(Attendee.id)).filter(
+        Attendee.group_id == Group.id).correlate(Group).scalar_subquery()
+    return session.dealer_groups(*statuses).add_columns(
+        badges.label('badges'), Group.amount_paid.label('amount_paid')).options(
+        joinedload(Group.leader)).yield_per(DEALER_EXPORT_BATCH_SIZE)
+
+
+def dealer_cost_breakdown(session):
+    """
+    Buckets dealer groups with badges and a cost into paid/unpaid tables, badges, power, and custom
+    fees. Rows are aggregated by the database, so we only ever see one row per distinct combination
+    of paid status, auto-recalc, tables, badges purchased, and power level.
+    """
+    badges_purchased = session.query(func.count(Attendee.id)).filter(
+        Attendee.group_id == Group.id, Attendee.paid == c.PAID_BY_GROUP).correlate(Group).scalar_subquery()
+
+    dealers = session.query(
+        (Group.amount_paid >= Group.cost * 100).label('is_paid'),
+        Group.auto_recalc.label('auto_recalc'),
+        Group.tables.label('tables'),
+        badges_purchased.label('badges_purchased'),
+        Group.power.label('power'),
+        Group.cost.label('cost'),
+        Group.power_fee.label('power_fee'),
+    ).filter(Group.is_dealer == True,  # noqa: E712
+             Group.attendees_have_badges == True, Group.cost > 0).subquery()  # noqa: E712
+
+    buckets = session.query(
+        dealers.c.is_paid, dealers.c.auto_recalc, dealers.c.tables, dealers.c.badges_purchased, dealers.c.power,
+        func.count(), func.sum(dealers.c.cost), func.sum(dealers.c.power_fee)
+    ).group_by(dealers.c.is_paid, dealers.c.auto_recalc, dealers.c.tables, dealers.c.badges_purchased,
+               dealers.c.power)
+
+    totals = {'paid': 0, 'unpaid': 0}
+    custom = {'paid': defaultdict(int), 'unpaid': defaultdict(int)}
+    tables = {'paid': defaultdict(int), 'unpaid': defaultdict(int)}
+    badges = {'paid': defaultdict(int), 'unpaid': defaultdict(int)}
+    power = {'paid': defaultdict(int), 'unpaid': defaultdict(int)}
+
+    for is_paid, auto_recalc, table_count, badges_count, power_level, count, cost_sum, power_fee_sum in buckets:
+        key = 'paid' if is_paid else 'unpaid'
+        totals[key] += count
+        if not auto_recalc:
+            custom[key]['count'] += count
+            custom[key]['sum'] += cost_sum
+        else:
+            tables[key][table_count] += count
+            badges[key][badges_count] += count
+            if power_level > 0 and c.POWER_PRICES.get(int(power_level), None) is None:
+                custom[key]['power_count'] += count
+                custom[key]['power_sum'] += power_fee_sum
+            elif power_level > 0:
+                power[key][power_level] += count
+
+    breakdown = {'total_dealers': totals['paid'] + totals['unpaid']}
+    for key in ['paid', 'unpaid']:
+        tables[key].pop(0, None)
+        badges[key].pop(0, None)
+
+        table_sums = defaultdict(int)
+        for table_count in tables[key]:
+            table_sums[table_count] = c.get_table_price(table_count) * tables[key][table_count]
+
+        power_sums = defaultdict(int)
+        for power_level in power[key]:
+            power_sums[power_level] = int(c.POWER_PRICES[power_level]) * power[key][power_level]
+
+        breakdown.update({
+            f'{key}_total': totals[key],
+            f'{key}_custom': custom[key],
+            f'{key}_tables': tables[key],
+            f'{key}_tables_total': get_dict_sum(tables[key]),
+            f'{key}_table_sums': table_sums,
+            f'all_{key}_tables_sum': sum(table_sums.values()),
+            f'{key}_badges': badges[key],
+            f'{key}_badges_total': get_dict_sum(badges[key]),
+            f'{key}_power': power[key],
+            f'{key}_power_total': sum(power[key].values()),
+            f'{key}_power_sums': power_sums,
+            f'all_{key}_power_sum': sum(power_sums.values()) + custom[key]['power_sum'],
+        })
+
+    return breakdown
+
+
+def registration_velocity_data(resolution='minute', now=None):
+    """
+    Completed registrations and upgrades per minute (or per hour) over the last REGISTRATION_VELOCITY_MINUTES
+    minutes, from the in-memory counts in registration_velocity rather than the attendee table.
+    """
+    now = now or localized_now()
+    bucket_minutes = 60 if resolution == 'hour' else 1
+    num_buckets = c.REGISTRATION_VELOCITY_MINUTES // bucket_minutes
+
+    def rebucket(per_minute):
+        # The newest bucket ends with the current minute; drop any leftover minutes at the start
+        per_minute = np.asarray(per_minute[len(per_minute) - num_buckets * bucket_minutes:], dtype=np.int64)
+        return per_minute.reshape(num_buckets, bucket_minutes).sum(axis=1).tolist()
+
+    per_minute = registration_velocity.per_minute(now)
+    first_bucket = now.replace(second=0, microsecond=0) - timedelta(minutes=(num_buckets - 1) * bucket_minutes)
+    return {
+        'resolution': 'hour' if bucket_minutes == 60 else 'minute',
+        'labels': [(first_bucket + timedelta(minutes=i * bucket_minutes)).strftime('%a %H:%M')
+                   for i in range(num_buckets)],
+        'registrations': rebucket(per_minute[None]),
+        'upgrades': {c.BADGES[badge_type]: rebucket(counts)
+                     for badge_type, counts in per_minute.items() if badge_type is not None},
+        'upgrade_totals': {c.BADGES[badge_type]: badge_inventory.count(badge_type)
+                           for badge_type in c.BADGE_TYPE_PRICES},
+    }
+
+
+def registration_history_dir():
+    return os.path.join(c.UPLOADED_FILES_DIR, c.REGISTRATION_HISTORY_DIR)
+
+
+@lru_cache(maxsize=None)
+def load_registration_history(path, modified):
+    # Past events never change, so each file is only read once per process (unless it's rewritten)
+    return RegistrationDataOneYear.from_history_file(path)
+
+
+def registration_history_files():
+    """
+    Returns the paths of registration counts saved for previous events, most recent first.
+    """
+    history_dir = registration_history_dir()
+    if not os.path.isdir(history_dir):
+        return []
+
+    end_date = c.DATES['ESCHATON'].strftime('%Y-%m-%d')
+    return [os.path.join(history_dir, filename) for filename in sorted(os.listdir(history_dir), reverse=True)
+            if filename.endswith(RegistrationDataOneYear.history_file_ext) and filename < end_date]
+
+
+def previous_years_registrations(limit=None):
+    # Previous events never need to touch the database
+    return [load_registration_history(path, os.stat(path).st_mtime_ns) for path in registration_history_files()[:limit]]
+
+
+def bucket_counts(indexes, counts, num_buckets):
+    """
+    Adds up counts into num_buckets buckets by index, e.g., day or hour offsets. Counts whose index
+    falls outside of the buckets are logged and dropped. Returns an int64 array of length num_buckets.
+    """
+    indexes = np.asarray(indexes, dtype=np.int64)
+    counts = np.asarray(counts, dtype=np.int64)
+    in_range = (indexes >= 0) & (indexes < num_buckets)
+    if not in_range.all():
+        log.info(
+            "Ignoring some analytics data because it's not in range of the report. For the attendance graph, "
+            "either c.ESCHATON is set incorrectly or you have registrations starting 1 year before ESCHATON, "
+            "or occuring after ESCHATON. indexes=" + str(indexes[~in_range].tolist()))
+
+    buckets = np.zeros(num_buckets, dtype=np.int64)
+    np.add.at(buckets, indexes[in_range], counts[in_range])
+    return buckets
+
+
+def trimmed_cumulative_sum(counts):
+    # Running total up until the last non-zero data point, leaving everything after that at zero
+    counts = np.asarray(counts, dtype=np.int64)
+    cumulative_sum = np.cumsum(counts)
+    nonzero = np.flatnonzero(counts)
+    cumulative_sum[nonzero[-1] + 1 if len(nonzero) else 0:] = 0
+    return cumulative_sum
+
+
+def rolling_average(counts, window=7):
+    # Trailing average of the last `window` buckets; the first few buckets average over what's available
+    counts = np.asarray(counts, dtype=np.int64)
+    running_total = np.concatenate(([0], np.cumsum(counts)))
+    end = np.arange(1, len(counts) + 1)
+    start = np.maximum(end - window, 0)
+    return (running_total[end] - running_total[start]) / (end - start)
+
+
 class RegistrationDataOneYear:
+    # Each previous event's registrations_per_day is saved as packed little-endian unsigned 32-bit
+    # integers in a file named after the event's end date, e.g. 2024-12-08.counts
+    history_file_ext = '.counts'
+
     def __init__(self):
         self.event_name = ""
 
@@ -38,6 +400,10 @@ class RegistrationDataOneYear:
 
         self.num_days_to_report = 365
 
+        # registrations taken each hour starting at on_sale_start (a naive UTC datetime), see query_on_sale_hours
+        self.on_sale_start = None
+        self.registrations_per_hour = []
+
     def query_current_year(self, session):
         self.event_name = c.EVENT_NAME_AND_YEAR
 
@@ -47,84 +413,82 @@ class RegistrationDataOneYear:
                                                     microsecond=0,
                                                     tzinfo=None)
 
-        # return registrations where people actually paid money
-        # exclude: dealers
-        reg_per_day = session.query(
-            func.date_trunc(literal('day'), Attendee.registered),
-            func.count(
-                func.date_trunc(literal('day'), Attendee.registered))
-        ) \
-            .outerjoin(Attendee.group) \
-            .filter(
-            (
-                (Attendee.paid == c.PAID_BY_GROUP) &  # if they're paid by group
-                (Group.amount_paid >= Group.cost * 100)  # make sure they've paid something, or are comped
-            ) | (  # OR
-                (Attendee.badge_status == c.COMPLETED_STATUS)
-                # if they're an attendee, make sure they're check-in-able
-            )
-        ) \
-            .group_by(func.date_trunc(literal('day'), Attendee.registered)) \
-            .order_by(func.date_trunc(literal('day'), Attendee.registered)) \
-            .all()  # noqa: E711
-
-        # now, convert the query's data into the format we need.
-        # SQL will skip days without registrations
-        # we need all self.num_days_to_report days to have data, even if it's zero
-
-        # create 365 elements in the final array
-        self.registrations_per_day = self.num_days_to_report * [0]
-
-        for reg_data in reg_per_day:
-            day = reg_data[0]
-            reg_count = reg_data[1]
-
-            day_offset = self.num_days_to_report - (
-                self.end_date - day).days
-            day_index = day_offset - 1
-
-            if day_index < 0 or day_index >= self.num_days_to_report:
-                log.info(
-                    "Ignoring some analytics data because it's not in range of the year before c.ESCHATON. "
-                    "Either c.ESCHATON is set incorrectly or you have registrations starting 1 year before ESCHATON, "
-                    "or occuring after ESCHATON. day_index=" + str(
-                        day_index))
-                continue
-
-            self.registrations_per_day[day_index] = reg_count
+        # registrations where people actually paid money, pre-aggregated by day (see DailyRegistrationCount)
+        first_day = self.end_date.date() - timedelta(days=self.num_days_to_report - 1)
+        reg_per_day = session.query(DailyRegistrationCount.day, DailyRegistrationCount.count).filter(
+            DailyRegistrationCount.day >= first_day, DailyRegistrationCount.day <= self.end_date.date())
+
+        self.set_registrations_per_day(reg_per_day)
+
+    def set_registrations_per_day(self, reg_per_day):
+        # SQL will skip days without registrations, but we need all
+        # self.num_days_to_report days to have data, even if it's zero
+        reg_per_day = list(reg_per_day)
+        days = np.array([day for day, reg_count in reg_per_day], dtype='datetime64[D]')
+        days_before_end = (np.datetime64(self.end_date.date(), 'D') - days).astype(np.int64)
+
+        self.registrations_per_day = bucket_counts(self.num_days_to_report - 1 - days_before_end,
+                                                   [reg_count for day, reg_count in reg_per_day],
+                                                   self.num_days_to_report).tolist()
 
         self.compute_cumulative_sum_from_registrations_per_day()
 
     # compute cumulative sum up until the last non-zero data point
     def compute_cumulative_sum_from_registrations_per_day(self):
-
         if len(self.registrations_per_day) != self.num_days_to_report:
-            raise 'array validation error: array size should be the same as the report size'
-
-        # figure out where the last non-zero data point is in the array
-        last_useful_data_index = self.num_days_to_report - 1
-        for regs in reversed(self.registrations_per_day):
-            if regs != 0:
-                break  # found it, so we're done.
-            last_useful_data_index -= 1
-
-        # compute the cumulative sum, leaving all numbers past the last data point at zero
-        self.registrations_per_day_cumulative_sum = self.num_days_to_report * [
-            0]
-        total_so_far = 0
-        current_index = 0
-        for regs_this_day in self.registrations_per_day:
-            total_so_far += regs_this_day
-            self.registrations_per_day_cumulative_sum[
-                current_index] = total_so_far
-            if current_index == last_useful_data_index:
-                break
-            current_index += 1
+            raise ValueError('array validation error: array size should be the same as the report size')
+
+        self.registrations_per_day_cumulative_sum = trimmed_cumulative_sum(self.registrations_per_day).tolist()
+
+    def rolling_average_per_day(self, window=7):
+        return rolling_average(self.registrations_per_day, window)
+
+    def projected_total(self, today=None, window=7):
+        """
+        Projects the final number of registrations by assuming the rest of the days before the event
+        will average as many registrations as the last `window` days did.
+        """
+        today = today or localized_now().date()
+        days_left = (self.end_date.date() - today).days
+        today_index = min(max(self.num_days_to_report - 1 - days_left, 0), self.num_days_to_report - 1)
+
+        total = int(np.sum(self.registrations_per_day[:today_index + 1]))
+        if days_left <= 0:
+            return total
+        return int(round(total + self.rolling_average_per_day(window)[today_index] * days_left))
+
+    def query_on_sale_hours(self, session, start=None, num_hours=None):
+        """
+        Counts registrations per hour for the first num_hours hours after registration opened, when
+        days are far too coarse to see what happened. Sets on_sale_start and registrations_per_hour.
+        """
+        start = (start or c.PREREG_OPEN).astimezone(UTC).replace(minute=0, second=0, microsecond=0)
+        num_hours = num_hours or c.ATTENDANCE_GRAPH_ON_SALE_HOURS
+        self.on_sale_start = start.replace(tzinfo=None)
+        self.registrations_per_hour = on_sale_hour_counts(session, start, num_hours)
+
+    def save_to_history_file(self):
+        os.makedirs(registration_history_dir(), exist_ok=True)
+        path = os.path.join(registration_history_dir(), self.end_date.strftime('%Y-%m-%d') + self.history_file_ext)
+        np.asarray(self.registrations_per_day, dtype='<u4').tofile(path)
+        return path
+
+    @classmethod
+    def from_history_file(cls, path):
+        year_data = cls()
+        year_data.end_date = datetime.strptime(os.path.basename(path)[:-len(cls.history_file_ext)], '%Y-%m-%d')
+        year_data.event_name = f"{c.EVENT_NAME} {year_data.end_date.year}"
+        year_data.registrations_per_day = np.fromfile(path, dtype='<u4').astype(np.int64).tolist()
+        year_data.compute_cumulative_sum_from_registrations_per_day()
+        return year_data
 
     def dump_data(self):
         return {
             "registrations_per_day": self.registrations_per_day,
             "registrations_per_day_cumulative_sum": self.registrations_per_day_cumulative_sum,
+            "registrations_rolling_average": [round(avg, 1) for avg in self.rolling_average_per_day().tolist()],
+            "registrations_per_hour": self.registrations_per_hour,
+            "on_sale_start": self.on_sale_start.strftime("%Y-%m-%d %H:00 UTC") if self.on_sale_start else "",
             "event_name": self.event_name,
             "event_end_date": self.end_date.strftime("%d-%m-%Y"),
         }
@@ -134,50 +498,71 @@ class Root:
     def index(self, session):
         pass
 
-    def comped_badges(self, session, message='', show='all'):
-        all_comped = session.valid_attendees()\
-            .filter(Attendee.paid == c.NEED_NOT_PAY)
-        claimed_comped = all_comped.filter(Attendee.placeholder == False)
-        unclaimed_comped = all_comped.filter(Attendee.placeholder == True)
-        if show == 'claimed':
-            comped_attendees = claimed_comped
-        elif show == 'unclaimed':
-            comped_attendees = unclaimed_comped
-        else:
-            comped_attendees = all_comped
+    def comped_badges(self, session, message='', show='all', sort='name', search='', after=None, before=None):
+        comped_attendees, has_previous, has_next = comped_badges_page(session, show, sort, search, after, before)
 
-        return {
+        return dict(comped_badge_counts(session), **{
             'message': message,
             'comped_attendees': comped_attendees,
-            'all_comped': all_comped.count(),
-            'claimed_comped': claimed_comped.count(),
-            'unclaimed_comped': unclaimed_comped.count(),
-            'show': show
+            'first_id': comped_attendees[0].id if comped_attendees else None,
+            'last_id': comped_attendees[-1].id if comped_attendees else None,
+            'has_previous': has_previous,
+            'has_next': has_next,
+            'show': show,
+            'sort': sort if sort in COMPED_BADGES_SORTS else 'name',
+            'search': search,
+        })
+
+    def late_dealers(self, session, due_within_days=0):
+        due_within_days = int(due_within_days or 0)
+        return {
+            'groups': late_dealer_groups(session, due_within_days).all(),
+            'late_count': late_dealer_groups(session).count(),
+            'due_soon_count': late_dealer_groups(session, 7).count(),
+            'due_within_days': due_within_days,
         }
 
     def sponsors_counts(self, session):
-        sponsors = session.query(Attendee).filter(Attendee.badge_type == c.SPONSOR_BADGE)
-        shiny_sponsors = session.query(Attendee).filter(Attendee.badge_type == c.SHINY_BADGE)
-        sponsor_counts = {}
-        shiny_counts = {}
+        status_counts = badge_status_matrix(session, [c.SPONSOR_BADGE, c.SHINY_BADGE])
+
+        return {
+            'sponsor_counts': status_counts[c.SPONSOR_BADGE],
+            'shiny_counts': status_counts[c.SHINY_BADGE],
+        }
 
-        for val, desc in c.BADGE_STATUS_OPTS:
-            sponsor_counts[desc] = sponsors.filter(Attendee.badge_status == val).count()
-            shiny_counts[desc] = shiny_sponsors.filter(Attendee.badge_status == val).count()
+    def upgrade_counts(self, session):
+        upgrade_types = sorted(c.BADGE_TYPE_PRICES, key=c.BADGE_TYPE_PRICES.get)
+        status_counts = badge_status_matrix(session, upgrade_types)
 
         return {
-            'sponsor_counts': sponsor_counts,
-            'shiny_counts': shiny_counts,
+            'upgrade_types': upgrade_types,
+            'status_counts': status_counts,
+            'totals': {badge_type: sum(status_counts[badge_type].values()) for badge_type in upgrade_types},
         }
 
-    def attendance_graph(self, session):
+    def attendance_graph(self, session, compare_years=0):
         graph_data_current_year = RegistrationDataOneYear()
         graph_data_current_year.query_current_year(session)
+        graph_data_current_year.query_on_sale_hours(session)
+
+        compare_years = int(compare_years or 0)
+        previous_years = previous_years_registrations(compare_years) if compare_years else []
 
         return {
             'current_registrations': graph_data_current_year.dump_data(),
+            'projected_total': graph_data_current_year.projected_total(),
+            'previous_registrations': [year_data.dump_data() for year_data in previous_years],
+            'compare_years': compare_years,
+            'years_available': len(registration_history_files()),
         }
 
+    def registration_velocity(self, session, resolution='minute'):
+        return {'velocity': registration_velocity_data(resolution)}
+
+    @ajax_gettable
+    def registration_velocity_counts(self, session, resolution='minute'):
+        return registration_velocity_data(resolution)
+
     @csv_file
     def accessibility_report(self, out, session):
         out.writerow([
@@ -188,16 +573,11 @@ class Root:
             'Other Desired Accommodations'
         ])
 
-        accessibility_request_attendees = session.query(Attendee).filter(Attendee.accessibility_requests != '').all()
+        for row in accessibility_request_rows(session):
+            out.writerow(row)
 
-        for attendee in accessibility_request_attendees:
-            out.writerow([
-                attendee.badge_printed_name,
-                attendee.badge_num,
-                attendee.email,
-                ", ".join(attendee.accessibility_requests_labels),
-                attendee.other_accessibility_requests
-            ])
+    def accessibility_counts(self, session):
+        return {'service_counts': accessibility_service_counts(session)}
 
     @public
     def view_table_photo(self, session, id):
@@ -250,48 +630,46 @@ class Root:
             'IP Concerns',
             'Other Concerns'
         ])
-        dealer_groups = session.query(Group).filter(Group.is_dealer == True).all()
-        for group in dealer_groups:
-            if group.is_dealer:
-                full_name = group.leader.full_name if group.leader else ''
-                out.writerow([
-                    group.name,
-                    full_name,
-                    group.leader.email if group.leader else '',
-                    group.tables,
-                    group.badges,
-                    group.status_label,
-                    group.amount_paid,
-                    group.website,
-                    group.categories_labels,
-                    group.categories_text,
-                    group.description,
-                    group.special_needs,
-                    group.review_notes,
-                    group.admin_notes,
-                    group.power,
-                    group.power_usage,
-                    group.location_preference_label,
-                    group.location,
-                    group.social_media,
-                    group.review_notes,
-                    group.mff_alumni,
-                    group.art_show_intent,
-                    group.adult_content_label,
-                    group.ip_issues_label,
-                    group.ip_issues_text,
-                    group.other_cons,
-                    f"{c.URL_BASE}/mff_reports/view_table_photo?id={group.id}" if group.table_photo_filename else '',
-                    group.shipping_boxes,
-                    group.vehicle_access,
-                    group.display_height,
-                    group.at_con_standby,
-                    group.at_con_standby_text,
-                    group.socials_checked,
-                    group.table_seen,
-                    group.ip_concerns,
-                    group.other_concerns,
-                ])
+        for group, badges, amount_paid in dealer_groups_with_totals_for_export(session):
+            leader = group.leader
+            out.writerow([
+                group.name,
+                leader.full_name if leader else '',
+                leader.email if leader else '',
+                group.tables,
+                badges,
+                group.status_label,
+                amount_paid,
+                group.website,
+                group.categories_labels,
+                group.categories_text,
+                group.description,
+                group.special_needs,
+                group.review_notes,
+                group.admin_notes,
+                group.power,
+                group.power_usage,
+                group.location_preference_label,
+                group.location,
+                group.social_media,
+                group.review_notes,
+                group.mff_alumni,
+                group.art_show_intent,
+                group.adult_content_label,
+                group.ip_issues_label,
+                group.ip_issues_text,
+                group.other_cons,
+                f"{c.URL_BASE}/mff_reports/view_table_photo?id={group.id}" if group.table_photo_filename else '',
+                group.shipping_boxes,
+                group.vehicle_access,
+                group.display_height,
+                group.at_con_standby,
+                group.at_con_standby_text,
+                group.socials_checked,
+                group.table_seen,
+                group.ip_concerns,
+                group.other_concerns,
+            ])
 
     @csv_file
     def dealers_publication_listing(self, out, session):
@@ -301,9 +679,7 @@ class Root:
             'URL',
             'Location'
         ])
-        dealer_groups = session.query(Group).filter(Group.is_dealer == True,
-                                                    Group.status.in_([c.APPROVED, c.SHARED])).all()
-        for group in dealer_groups:
+        for group in session.dealer_groups(c.APPROVED, c.SHARED):
             out.writerow([
                 group.name,
                 group.description,
@@ -345,112 +721,24 @@ class Root:
             'Phone Number',
             'Tax Number'
         ])
-        dealer_groups = session.query(Group).filter(Group.is_dealer == True,
-                                                    Group.status.in_([c.APPROVED, c.SHARED])).all()
-        for group in dealer_groups:
+        for group in dealer_groups_for_export(session, c.APPROVED, c.SHARED):
+            leader = group.leader
             out.writerow([
                 group.name,
-                group.leader.full_name if group.leader else '',
+                leader.full_name if leader else '',
                 group.address1,
                 group.address2,
                 group.city,
                 group.region,
                 group.zip_code,
                 group.country,
-                group.leader.email if group.leader else '',
-                group.leader.cellphone if group.leader else '',
+                leader.email if leader else '',
+                leader.cellphone if leader else '',
                 group.tax_number
             ])
 
     def dealer_cost_summary(self, session, message=''):
-        dealers = session.query(Group).filter(Group.is_dealer == True,  # noqa: E712
-                                              Group.attendees_have_badges == True, Group.cost > 0)  # noqa: E712
-        
-        paid_total = 0
-        paid_custom = defaultdict(int)
-        paid_tables = defaultdict(int)
-        paid_table_sums = defaultdict(int)
-        paid_badges = defaultdict(int)
-        paid_power = defaultdict(int)
-        paid_power_sums = defaultdict(int)
-
-        unpaid_total = 0
-        unpaid_custom = defaultdict(int)
-        unpaid_tables = defaultdict(int)
-        unpaid_table_sums = defaultdict(int)
-        unpaid_badges = defaultdict(int)
-        unpaid_power = defaultdict(int)
-        unpaid_power_sums = defaultdict(int)
-
-        for group in dealers:
-            if group.is_paid:
-                paid_total += 1
-                if not group.auto_recalc:
-                    paid_custom['count'] += 1
-                    paid_custom['sum'] += group.cost
-                else:
-                    paid_tables[group.tables] += 1
-                    paid_badges[group.badges_purchased] += 1
-                    if group.power > 0 and group.default_power_fee is None:
-                        paid_custom['power_count'] += 1
-                        paid_custom['power_sum'] += group.power_fee
-                    elif group.power > 0:
-                        paid_power[group.power] += 1
-            else:
-                unpaid_total += 1
-                if not group.auto_recalc:
-                    unpaid_custom['count'] += 1
-                    unpaid_custom['sum'] += group.cost
-                else:
-                    unpaid_tables[group.tables] += 1
-                    unpaid_badges[group.badges_purchased] += 1
-                    if group.power > 0 and group.default_power_fee is None:
-                        unpaid_custom['power_count'] += 1
-                        unpaid_custom['power_sum'] += group.power_fee
-                    elif group.power > 0:
-                        unpaid_power[group.power] += 1
-
-        for dict in [paid_tables, paid_badges, unpaid_tables, unpaid_badges]:
-            dict.pop(0, None)
-
-        for tables in paid_tables:
-            paid_table_sums[tables] = c.get_table_price(tables) * paid_tables[tables]
-        for tables in unpaid_tables:
-            unpaid_table_sums[tables] = c.get_table_price(tables) * unpaid_tables[tables]
-
-        for power in paid_power:
-            paid_power_sums[power] = int(c.POWER_PRICES[power]) * paid_power[power]
-        for power in unpaid_power:
-            unpaid_power_sums[power] = int(c.POWER_PRICES[power]) * unpaid_power[power]
-
-        return {
-            'total_dealers': dealers.count(),
-            'paid_total': paid_total,
-            'paid_custom': paid_custom,
-            'paid_tables': paid_tables,
-            'paid_tables_total': get_dict_sum(paid_tables),
-            'paid_table_sums': paid_table_sums,
-            'all_paid_tables_sum': sum(paid_table_sums.values()),
-            'paid_badges': paid_badges,
-            'paid_badges_total': get_dict_sum(paid_badges),
-            'paid_power': paid_power,
-            'paid_power_total': sum(paid_power.values()),
-            'paid_power_sums': paid_power_sums,
-            'all_paid_power_sum': sum(paid_power_sums.values()) + paid_custom['power_sum'],
-            'unpaid_total': unpaid_total,
-            'unpaid_custom': unpaid_custom,
-            'unpaid_tables': unpaid_tables,
-            'unpaid_tables_total': get_dict_sum(unpaid_tables),
-            'unpaid_table_sums': unpaid_table_sums,
-            'all_unpaid_tables_sum': sum(unpaid_table_sums.values()),
-            'unpaid_badges': unpaid_badges,
-            'unpaid_badges_total': get_dict_sum(unpaid_badges),
-            'unpaid_power': unpaid_power,
-            'unpaid_power_total': sum(unpaid_power.values()),
-            'unpaid_power_sums': unpaid_power_sums,
-            'all_unpaid_power_sum': sum(unpaid_power_sums.values()) + unpaid_custom['power_sum'],
-            'now': localized_now(),
-        }
+        return dict(dealer_cost_breakdown(session), now=localized_now())
 
     @csv_file
     def dealers_application_review_report(self, out, session):
@@ -483,37 +771,35 @@ class Root:
             'IP Concerns',
             'Other Concerns'
         ])
-        dealer_groups = session.query(Group).filter(Group.is_dealer == True).all()
-        for group in dealer_groups:
-            if group.is_dealer and group.status_label == 'Pending Approval':
-                full_name = group.leader.full_name if group.leader else ''
-                out.writerow([
-                    group.name,
-                    full_name,
-                    group.tables,
-                    group.website,
-                    group.leader.email if group.leader else '',
-                    group.categories_labels,
-                    group.categories_text,
-                    group.description,
-                    group.special_needs,
-                    group.review_notes,
-                    group.admin_notes,
-                    group.power,
-                    group.power_usage,
-                    group.location_preference_label,
-                    group.social_media,
-                    group.review_notes,
-                    group.mff_alumni,
-                    group.art_show_intent,
-                    group.adult_content_label,
-                    group.ip_issues_label,
-                    group.ip_issues_text,
-                    group.other_cons,
-                    f"{c.URL_BASE}/mff_reports/view_table_photo?id={group.id}" if group.table_photo_filename else '',
-                    group.socials_checked,
-                    group.table_seen,
-                    group.ip_concerns,
-                    group.other_concerns,
-                ])
+        for group in dealer_groups_for_export(session, c.UNAPPROVED):
+            leader = group.leader
+            out.writerow([
+                group.name,
+                leader.full_name if leader else '',
+                group.tables,
+                group.website,
+                leader.email if leader else '',
+                group.categories_labels,
+                group.categories_text,
+                group.description,
+                group.special_needs,
+                group.review_notes,
+                group.admin_notes,
+                group.power,
+                group.power_usage,
+                group.location_preference_label,
+                group.social_media,
+                group.review_notes,
+                group.mff_alumni,
+                group.art_show_intent,
+                group.adult_content_label,
+                group.ip_issues_label,
+                group.ip_issues_text,
+                group.other_cons,
+                f"{c.URL_BASE}/mff_reports/view_table_photo?id={group.id}" if group.table_photo_filename else '',
+                group.socials_checked,
+                group.table_seen,
+                group.ip_concerns,
+                group.other_concerns,
+            ])
 
@@ -1,5 +1,5 @@
 from collections import defaultdict
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from pockets import groupify
 
 import stripe
@@ -7,8 +7,9 @@ import time
 import pytz
 from celery.schedules import crontab
 from pockets.autolog import log
-from sqlalchemy import not_, or_, insert
-from sqlalchemy.orm import joinedload
+from sqlalchemy import event, not_, or_, insert
+from sqlalchemy.orm import joinedload, selectinload
+from sqlalchemy.orm import Session as SASession
 from sqlalchemy.orm.exc import NoResultFound
 
 from uber.config import c
@@ -17,13 +18,83 @@ from uber.decorators import render
 from uber.models import (ApiJob, Attendee, AttendeeAccount, BadgeInfo, BadgePickupGroup, Email, Group, ModelReceipt,
                          ReceiptInfo, ReceiptItem, ReceiptTransaction, Session, TerminalSettlement)
 from uber.tasks.email import send_email
+from uber.tasks.registration import update_receipt
 from uber.tasks import celery
 from uber.utils import localized_now, TaskUtils
 from uber.payments import ReceiptManager, TransactionRequest
 
 
+# Key in Session.info for the tasks to send once the session commits, with the values to send them
+AFTER_COMMIT_TASKS = 'mff_after_commit_tasks'
+
+# The most values each task queued by queue_after_commit is sent at once
+AFTER_COMMIT_BATCH_SIZE = 500
+
+
+def queue_after_commit(session, task, values):
+    """
+    Collects values (e.g., ids) to send to a task once the session commits, so that something
+    touched many times in one transaction (e.g., during a bulk refund) is only handled once.
+    The task is sent a sorted list of values, in batches of up to AFTER_COMMIT_BATCH_SIZE.
+    """
+    session.info.setdefault(AFTER_COMMIT_TASKS, defaultdict(set))[task].update(values)
+
+
+@event.listens_for(SASession, 'after_commit')
+def send_after_commit_tasks(session):
+    for task, values in session.info.pop(AFTER_COMMIT_TASKS, {}).items():
+        values = sorted(values)
+        for i in range(0, len(values), AFTER_COMMIT_BATCH_SIZE):
+            task.delay(values[i:i + AFTER_COMMIT_BATCH_SIZE])
+
+
+@event.listens_for(SASession, 'after_rollback')
+def discard_after_commit_tasks(session):
+    session.info.pop(AFTER_COMMIT_TASKS, None)
+
+
+# Key in Session.info for the accounts to check for unneeded PIT badges, until the flush gives new ones their ids
+PENDING_PIT_BADGE_CHECKS = 'mff_pending_pit_badge_checks'
+
+
+def queue_pit_badge_check(session, accounts):
+    # Presave adjustments run before the flush, when accounts created in this transaction have no id yet
+    session.info.setdefault(PENDING_PIT_BADGE_CHECKS, set()).update(accounts)
+
+
+@event.listens_for(SASession, 'after_flush_postexec')
+def queue_pending_pit_badge_checks(session, flush_context):
+    accounts = session.info.pop(PENDING_PIT_BADGE_CHECKS, None)
+    if accounts:
+        queue_after_commit(session, check_pit_badges, [account.id for account in accounts if account.id])
+
+
+@event.listens_for(SASession, 'after_rollback')
+def discard_pending_pit_badge_checks(session):
+    session.info.pop(PENDING_PIT_BADGE_CHECKS, None)
+
+
+def invalidate_unneeded_pit_badges(session, accounts):
+    for account in accounts:
+        pit_eligibility = account.pit_eligibility
+        pit_badge = pit_eligibility.pit_badge
+        if pit_badge and not pit_eligibility.paid_minors and not pit_eligibility.pending_minors:
+            pit_badge.badge_status = c.INVALID_STATUS
+            session.add(pit_badge)
+
+
+@celery.task
+def check_pit_badges(account_ids):
+    with Session() as session:
+        accounts = session.query(AttendeeAccount).filter(AttendeeAccount.id.in_(account_ids)).options(
+            selectinload(AttendeeAccount.attendees))
+        invalidate_unneeded_pit_badges(session, accounts)
+        session.commit()
+
+
 @celery.task
 def check_pit_badge(badge_id):
+    # Superseded by check_pit_badges, but kept so that tasks queued before an upgrade still run
     with Session() as session:
         try:
             badge = session.attendee(badge_id)
@@ -31,12 +102,28 @@ def check_pit_badge(badge_id):
             return
 
         if badge.managers:
-            account = badge.managers[0]
-            pit_badge = account.pit_badge
-            pending_minors = [a for a in account.attendees if (
-                a.badge_status == c.PENDING_STATUS or a.paid == c.PENDING) and 
-                a.birthdate and a.age_now_or_at_con < 18]
-            if pit_badge and not account.paid_minors and not pending_minors:
-                pit_badge.badge_status = c.INVALID_STATUS
-            session.add(pit_badge)
-            session.commit()
\ No newline at end of file
+            invalidate_unneeded_pit_badges(session, badge.managers[:1])
+            session.commit()
+
+
+@celery.task
+def update_daily_registrations(days):
+    from .models import refresh_daily_registrations
+    with Session() as session:
+        refresh_daily_registrations(session, [date.fromisoformat(day) for day in days])
+        session.commit()
+
+
+@celery.task
+def update_need_not_pay_receipts(attendee_ids):
+    # Queued once per transaction by the not-attending and in-tow presave adjustments
+    for attendee_id in attendee_ids:
+        update_receipt(attendee_id, {'paid': c.NEED_NOT_PAY})
+
+
+@celery.schedule(crontab(hour=4, minute=30))
+def reconcile_daily_registrations():
+    from .models import rebuild_daily_registrations
+    with Session() as session:
+        rebuild_daily_registrations(session)
+        session.commit()
@@ -0,0 +1,19 @@
+import pytest
+from sqlalchemy import create_engine
+
+from uber.models import Session
+
+
+@pytest.fixture
+def sqlite_db(tmp_path):
+    Session.engine = create_engine(f"sqlite:///{tmp_path / 'mff_rams_plugin.db'}")
+    Session.session_factory.configure(bind=Session.engine)
+    Session.initialize_db(modify_tables=True, drop=True)
+    yield Session.engine
+    Session.engine.dispose()
+
+
+@pytest.fixture
+def session(sqlite_db):
+    with Session() as session:
+        yield session
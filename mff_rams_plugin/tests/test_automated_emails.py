@@ -0,0 +1,83 @@
+from datetime import timedelta
+
+import pytest
+
+from uber.config import c
+from uber.models import ArtShowApplication, Attendee, AttendeeAccount, Group, LotteryApplication
+from uber.utils import localized_now
+from mff_rams_plugin.automated_emails import MFF_EMAIL_IDENTS, prefilter_misses
+
+
+@pytest.fixture
+def email_candidates(session):
+    # A spread of attendees, groups and applications both inside and outside of each prefilter
+    ribbons = ['', str(c.VOLUNTEER_RIBBON), str(c.STAFF_RIBBON), f'{c.STAFF_RIBBON},{c.VOLUNTEER_RIBBON}']
+    badge_types = [c.ATTENDEE_BADGE, c.STAFF_BADGE, c.PARENT_IN_TOW_BADGE, c.KID_IN_TOW_BADGE]
+    services = [str(service) for service, label in c.ACCESSIBILITY_SERVICE_OPTS]
+    for i in range(32):
+        account = AttendeeAccount(email=f'account{i}@example.com')
+        attendee = Attendee(first_name='Email', last_name=str(i), email=f'email{i}@example.com',
+                            ribbon=ribbons[i % 4], badge_type=badge_types[i // 4 % 4], placeholder=bool(i % 3 == 0),
+                            cellphone='' if i % 2 else '5555555555',
+                            requested_accessibility_services=bool(i % 5 == 0),
+                            accessibility_requests=services[i % len(services)] if i % 5 == 0 else '')
+        account.attendees.append(attendee)
+        session.add(account)
+
+        if i % 4 == 0:
+            session.add(LotteryApplication(attendee=attendee, status=c.COMPLETE if i % 8 else c.PARTIAL,
+                                           cellphone='' if i % 3 else '5555555555'))
+        if i % 6 == 0:
+            session.add(ArtShowApplication(attendee=attendee, status=c.APPROVED if i % 12 else c.UNAPPROVED))
+
+    statuses = [c.APPROVED, c.SHARED, c.WAITLISTED, c.DECLINED, c.UNAPPROVED]
+    for i, status in enumerate(statuses * 3):
+        group = Group(name=f'Dealer {i}', tables=1, is_dealer=True, status=status, cost=100 * (i % 2),
+                      approved=localized_now() - timedelta(days=40 * (i % 3)))
+        group.attendees.append(Attendee(first_name='Dealer', last_name=str(i), paid=c.PAID_BY_GROUP,
+                                        badge_status=c.UNAPPROVED_DEALER_STATUS if status == c.UNAPPROVED
+                                        else c.COMPLETED_STATUS))
+        session.add(group)
+    session.commit()
+
+
+@pytest.mark.parametrize('ident', MFF_EMAIL_IDENTS)
+def test_prefilter_never_excludes_a_match(session, email_candidates, ident):
+    assert prefilter_misses(session, ident) == []
+
+
+def test_accessibility_prefilter_includes_flag_without_services(session):
+    attendee = Attendee(first_name='No', last_name='Services', requested_accessibility_services=True,
+                        accessibility_requests='', other_accessibility_requests='Will explain at the con')
+    session.add(attendee)
+    session.commit()
+
+    assert prefilter_misses(session, 'accessibility_info') == []
+
+
+@pytest.mark.parametrize('eligibility', ['staff_hotel_lottery_eligible', 'dealer_hotel_lottery_eligible'])
+def test_hotel_lottery_eligibility_expressions_match_python(session, email_candidates, eligibility):
+    in_sql = {a.id for a in session.query(Attendee).filter(getattr(Attendee, eligibility))}
+    in_python = {a.id for a in session.query(Attendee) if getattr(a, eligibility)}
+    assert in_sql == in_python
+
+
+def test_dealer_hotel_lottery_eligible_matches_is_dealer(session, email_candidates):
+    non_dealers = Group(name='Not Dealers', tables=0, is_dealer=False)
+    non_dealers.attendees.append(Attendee(first_name='Group', last_name='Member', paid=c.PAID_BY_GROUP))
+    dealers = Group(name='Paying Dealers', tables=1, is_dealer=True, status=c.APPROVED)
+    dealers.attendees.append(Attendee(first_name='Paid', last_name='Themselves', paid=c.HAS_PAID))
+    session.add_all([non_dealers, dealers, Attendee(first_name='Dealer', last_name='Ribbon',
+                                                    ribbon=str(c.DEALER_RIBBON), badge_status=c.COMPLETED_STATUS)])
+    session.commit()
+
+    in_sql = {a.id for a in session.query(Attendee).filter(Attendee.dealer_hotel_lottery_eligible)}
+    with_core_is_dealer = {a.id for a in session.query(Attendee)
+                           if a.is_dealer and a.badge_status != c.UNAPPROVED_DEALER_STATUS}
+    assert in_sql == with_core_is_dealer
+
+
+def test_hotel_lottery_instructions_accounts(session, email_candidates):
+    accounts = session.query(AttendeeAccount).filter(AttendeeAccount.has_hotel_eligible_non_staff()).all()
+    assert accounts
+    assert all(any(not a.staff_hotel_lottery_eligible for a in account.attendees) for account in accounts)
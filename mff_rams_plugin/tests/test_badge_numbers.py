@@ -0,0 +1,130 @@
+import threading
+
+import pytest
+from sqlalchemy import update
+
+from uber.config import c
+from uber.models import Attendee, BadgeInfo, Session
+from mff_rams_plugin.badge_numbers import badge_numbers, BadgeResync
+from mff_rams_plugin.models import ribbon_ints_of
+
+WORKERS = 4
+BADGES_PER_WORKER = 8
+
+
+@pytest.fixture
+def attendees(session):
+    attendees = [Attendee(first_name='Worker', last_name=str(i), badge_status=c.COMPLETED_STATUS)
+                 for i in range(WORKERS * BADGES_PER_WORKER)]
+    session.add_all(attendees)
+    session.commit()
+    return attendees
+
+
+@pytest.fixture
+def badge_range(session, attendees, monkeypatch):
+    # A block of numbers above every configured range, so nothing assigned while saving the attendees is in it
+    lower_bound = max(upper for lower, upper in c.BADGE_RANGES.values()) + 1000
+    upper_bound = lower_bound + WORKERS * BADGES_PER_WORKER + 7
+    monkeypatch.setitem(c.BADGE_RANGES, c.ATTENDEE_BADGE, (lower_bound, upper_bound))
+
+    existing = {ident for ident, in session.query(BadgeInfo.ident).filter(BadgeInfo.ident.between(lower_bound, upper_bound))}
+    session.add_all([BadgeInfo(ident=ident) for ident in range(lower_bound, upper_bound + 1) if ident not in existing])
+    session.commit()
+    return lower_bound, upper_bound
+
+
+def test_allocate_hands_out_lowest_numbers_once_per_transaction(session, badge_range):
+    lower_bound, upper_bound = badge_range
+
+    first = badge_numbers.allocate(session, c.ATTENDEE_BADGE, 5)
+    second = badge_numbers.allocate(session, c.ATTENDEE_BADGE, 5)
+    assert [badge.ident for badge in first + second] == list(range(lower_bound, lower_bound + 10))
+
+    session.rollback()
+    assert [badge.ident for badge in badge_numbers.allocate(session, c.ATTENDEE_BADGE, 3)] == [
+        lower_bound, lower_bound + 1, lower_bound + 2]
+
+
+def test_concurrent_workers_never_share_a_number(attendees, badge_range):
+    lower_bound, upper_bound = badge_range
+    barrier = threading.Barrier(WORKERS)
+    errors = []
+
+    def assign_badges(attendee_ids):
+        try:
+            with Session() as session:
+                barrier.wait()
+                # Half of each worker's attendees are numbered one at a time and half in a single batch
+                half = len(attendee_ids) // 2
+                for attendee_id in attendee_ids[:half]:
+                    badge, = badge_numbers.allocate(session, c.ATTENDEE_BADGE)
+                    badge.assign(attendee_id)
+                    session.add(badge)
+                batch = badge_numbers.allocate(session, c.ATTENDEE_BADGE, len(attendee_ids) - half)
+                for attendee_id, badge in zip(attendee_ids[half:], batch):
+                    badge.assign(attendee_id)
+                    session.add(badge)
+                session.commit()
+        except Exception as e:
+            errors.append(e)
+
+    attendee_ids = [attendee.id for attendee in attendees]
+    workers = [threading.Thread(target=assign_badges, args=(attendee_ids[i::WORKERS], )) for i in range(WORKERS)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert errors == []
+
+    with Session() as session:
+        assigned = session.query(BadgeInfo.attendee_id).filter(BadgeInfo.ident.between(lower_bound, upper_bound),
+                                                              BadgeInfo.attendee_id != None).all()  # noqa: E711
+    assert sorted(attendee_id for attendee_id, in assigned) == sorted(attendee_ids)
+
+
+@pytest.fixture
+def imported_ribbons(session):
+    volunteer = Attendee(first_name='Volunteer', last_name='Promoted', badge_status=c.COMPLETED_STATUS, staffing=True)
+    unchanged = Attendee(first_name='Already', last_name='Fine', badge_status=c.COMPLETED_STATUS)
+    session.add_all([volunteer, unchanged])
+    session.commit()
+
+    # Write the ribbon directly, like an import would, so no presave adjustments run
+    session.execute(update(Attendee.__table__).where(Attendee.__table__.c.id == volunteer.id).values(
+        ribbon=f'{c.VOLUNTEER_RIBBON},{c.STAFF_RIBBON}', staffing=False))
+    session.commit()
+    session.expire_all()
+    return volunteer, unchanged
+
+
+def test_badge_resync_dry_run_changes_nothing(session, imported_ribbons):
+    volunteer, unchanged = imported_ribbons
+
+    resync = BadgeResync(session).compute()
+    assert resync.changes.get(unchanged.id, {}).keys() <= {'badge_num'}
+    assert resync.changes[volunteer.id]['staffing'] == (False, True)
+    assert set(ribbon_ints_of(resync.changes[volunteer.id]['ribbon'][1])) == {c.STAFF_RIBBON}
+    assert any(volunteer.id in line for line in resync.diff_lines())
+
+    session.rollback()
+    session.expire_all()
+    assert c.VOLUNTEER_RIBBON in volunteer.ribbon_ints and not volunteer.staffing
+
+
+def test_badge_resync_matches_presave_adjustments(session, imported_ribbons):
+    volunteer, unchanged = imported_ribbons
+
+    resync = BadgeResync(session, batch_size=1).compute()
+    resync.apply()
+    session.commit()
+    session.expire_all()
+
+    assert volunteer.ribbon_ints == [c.STAFF_RIBBON]
+    assert volunteer.has_ribbon(c.STAFF_RIBBON) and not volunteer.has_ribbon(c.VOLUNTEER_RIBBON)
+    assert volunteer.staffing
+    lower_bound, upper_bound = c.BADGE_RANGES[c.STAFF_BADGE]
+    assert volunteer.badge_num is None or lower_bound <= volunteer.badge_num <= upper_bound
+
+    # Only badge numbers can be left over, if a range has run out
+    assert all(changes.keys() <= {'badge_num'} for changes in BadgeResync(session).compute().changes.values())
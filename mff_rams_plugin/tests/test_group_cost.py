@@ -0,0 +1,45 @@
+import pytest
+
+from uber.config import c
+from uber.models import Attendee, Group
+
+
+@pytest.fixture
+def dealer_group(session):
+    group = Group(name='Twelve Badge Dealer', tables=4, is_dealer=True, auto_recalc=True)
+    for i in range(12):
+        group.attendees.append(Attendee(first_name='Dealer', last_name=str(i), paid=c.PAID_BY_GROUP))
+    session.add(group)
+    session.commit()
+    return group
+
+
+@pytest.fixture
+def cost_calculations(monkeypatch):
+    calls = []
+    calc_default_cost = Group.calc_default_cost
+
+    def counted_calc_default_cost(self):
+        calls.append(self.id)
+        return calc_default_cost(self)
+
+    monkeypatch.setattr(Group, 'calc_default_cost', counted_calc_default_cost)
+    return calls
+
+
+def test_group_cost_recalculated_once_per_flush(session, dealer_group, cost_calculations):
+    for attendee in dealer_group.attendees:
+        attendee.badge_printed_name = 'Renamed ' + attendee.last_name
+    session.commit()
+
+    assert cost_calculations == [dealer_group.id]
+    assert dealer_group.cost == dealer_group.calc_default_cost()
+
+
+def test_group_cost_follows_badge_changes(session, dealer_group):
+    for attendee in dealer_group.attendees[:6]:
+        attendee.paid = c.HAS_PAID
+    session.commit()
+
+    session.expire_all()
+    assert dealer_group.cost == dealer_group.calc_default_cost()
@@ -0,0 +1,549 @@
+from collections import defaultdict
+from datetime import timedelta
+
+import pytest
+from pytz import UTC
+from sqlalchemy import event
+
+from uber.config import c
+from uber.models import Attendee, Group, ModelReceipt, ReceiptTransaction, SignedDocument
+from uber.utils import localized_now
+from mff_rams_plugin import tasks
+from mff_rams_plugin.config import badge_inventory, RegistrationVelocity
+from mff_rams_plugin.models import (AttendeeAccessibilityRequest, count_registrations_per_day, DailyRegistrationCount,
+                                    rebuild_accessibility_request_rows, rebuild_daily_registrations,
+                                    refresh_daily_registrations, has_accessibility_request_rows)
+from mff_rams_plugin.site_sections import mff_reports
+from mff_rams_plugin.site_sections.mff_reports import (accessibility_request_rows, accessibility_service_counts,
+                                                      badge_status_matrix, comped_badge_counts, comped_badges_page,
+                                                      dealer_cost_breakdown, dealer_groups_with_totals_for_export,
+                                                      get_dict_sum, late_dealer_groups,
+                                                      previous_years_registrations, RegistrationDataOneYear)
+
+
+def legacy_dealer_cost_summary(session):
+    # The per-group Python loop that dealer_cost_summary used before it was moved into SQL
+    dealers = session.query(Group).filter(Group.is_dealer == True,  # noqa: E712
+                                          Group.attendees_have_badges == True, Group.cost > 0)  # noqa: E712
+    summary = {'total_dealers': dealers.count()}
+    for key in ['paid', 'unpaid']:
+        total = 0
+        custom, tables, badges, power = defaultdict(int), defaultdict(int), defaultdict(int), defaultdict(int)
+        table_sums, power_sums = defaultdict(int), defaultdict(int)
+        for group in dealers:
+            if bool(group.is_paid) != (key == 'paid'):
+                continue
+            total += 1
+            if not group.auto_recalc:
+                custom['count'] += 1
+                custom['sum'] += group.cost
+            else:
+                tables[group.tables] += 1
+                badges[group.badges_purchased] += 1
+                if group.power > 0 and group.default_power_fee is None:
+                    custom['power_count'] += 1
+                    custom['power_sum'] += group.power_fee
+                elif group.power > 0:
+                    power[group.power] += 1
+
+        tables.pop(0, None)
+        badges.pop(0, None)
+        for table_count in tables:
+            table_sums[table_count] = c.get_table_price(table_count) * tables[table_count]
+        for power_level in power:
+            power_sums[power_level] = int(c.POWER_PRICES[power_level]) * power[power_level]
+
+        summary.update({
+            f'{key}_total': total,
+            f'{key}_custom': custom,
+            f'{key}_tables': tables,
+            f'{key}_tables_total': get_dict_sum(tables),
+            f'{key}_table_sums': table_sums,
+            f'all_{key}_tables_sum': sum(table_sums.values()),
+            f'{key}_badges': badges,
+            f'{key}_badges_total': get_dict_sum(badges),
+            f'{key}_power': power,
+            f'{key}_power_total': sum(power.values()),
+            f'{key}_power_sums': power_sums,
+            f'all_{key}_power_sum': sum(power_sums.values()) + custom['power_sum'],
+        })
+    return summary
+
+
+@pytest.fixture
+def dealer_groups(session):
+    power_levels = sorted(c.DEALER_POWERS.keys())
+    for i in range(60):
+        group = Group(name=f'Dealer {i}', tables=i % 4 + 1, cost=100 + i * 5, status=c.APPROVED,
+                      auto_recalc=i % 7 != 0, power=power_levels[i % len(power_levels)], power_fee=i % 3 * 10)
+        session.add(group)
+        for j in range(i % 3 + 1):
+            session.add(Attendee(first_name=f'Dealer {i}', last_name=f'Badge {j}', group=group,
+                                 paid=c.PAID_BY_GROUP if j else c.HAS_PAID, badge_status=c.COMPLETED_STATUS))
+
+    # Groups with no cost are left out of the summary, whether or not they're paid up
+    for i in range(2):
+        group = Group(name=f'Free Dealer {i}', tables=1, cost=0, status=c.APPROVED, auto_recalc=False)
+        session.add(group)
+        session.add(Attendee(first_name=f'Free Dealer {i}', last_name='Badge', group=group, paid=c.PAID_BY_GROUP,
+                             badge_status=c.COMPLETED_STATUS))
+    session.commit()
+
+    # Every fifth group has paid in full, the next every fifth has paid part, one overpaid, and the rest nothing
+    groups = session.query(Group).filter(Group.cost > 0).order_by(Group.name).all()
+    for i, group in enumerate(groups):
+        cents = {0: group.cost * 100, 1: group.cost * 50, 2: group.cost * 100 + 500}.get(i % 5)
+        if cents:
+            receipt = ModelReceipt(owner_id=group.id, owner_model='Group')
+            session.add(receipt)
+            session.flush()
+            session.add(ReceiptTransaction(receipt_id=receipt.id, amount=cents, txn_total=cents, method=c.CASH,
+                                           desc='Dealer payment', who='test'))
+    session.commit()
+
+
+def test_dealer_cost_breakdown_matches_python_loop(session, dealer_groups):
+    breakdown = dealer_cost_breakdown(session)
+    assert breakdown == legacy_dealer_cost_summary(session)
+    assert breakdown['paid_total'] and breakdown['unpaid_total']
+
+    groups = session.query(Group).filter(Group.is_dealer == True).all()  # noqa: E712
+    assert any(group.is_paid for group in groups) and not all(group.is_paid for group in groups)
+
+
+def export_dealer_rows(session):
+    # The per-group values full_dealer_report writes that could need another query
+    return [(group.name, group.leader.full_name if group.leader else '', group.status_label, badges, amount_paid)
+            for group, badges, amount_paid in dealer_groups_with_totals_for_export(session)]
+
+
+def test_dealer_export_query_count_is_constant(session, dealer_groups, sqlite_db):
+    def count_queries():
+        session.expire_all()
+        statements = []
+
+        def count(*args):
+            statements.append(args[2])
+
+        event.listen(sqlite_db, 'before_cursor_execute', count)
+        try:
+            rows = export_dealer_rows(session)
+        finally:
+            event.remove(sqlite_db, 'before_cursor_execute', count)
+        return rows, len(statements)
+
+    rows, queries = count_queries()
+    assert queries == 1
+
+    # Adding more dealers doesn't add any queries
+    for i in range(20):
+        group = Group(name=f'Extra Dealer {i}', tables=1, cost=100, status=c.APPROVED)
+        session.add(group)
+        session.add(Attendee(first_name=f'Extra Dealer {i}', last_name='Badge', group=group, paid=c.PAID_BY_GROUP,
+                             badge_status=c.COMPLETED_STATUS))
+    session.commit()
+    more_rows, more_queries = count_queries()
+    assert len(more_rows) > len(rows) and more_queries == queries
+
+    groups = {group.name: group for group in session.dealer_groups()}
+    assert more_rows == [(name, groups[name].leader.full_name if groups[name].leader else '', groups[name].status_label,
+                          groups[name].badges, groups[name].amount_paid) for name, *_ in more_rows]
+
+
+def test_dealer_cost_breakdown_empty(session):
+    breakdown = dealer_cost_breakdown(session)
+    assert breakdown['total_dealers'] == 0
+    assert breakdown == legacy_dealer_cost_summary(session)
+
+
+def test_badge_status_matrix(session):
+    for badge_type, badge_status in [(c.SPONSOR_BADGE, c.COMPLETED_STATUS), (c.SPONSOR_BADGE, c.COMPLETED_STATUS),
+                                     (c.SPONSOR_BADGE, c.REFUNDED_STATUS), (c.SHINY_BADGE, c.NEW_STATUS),
+                                     (c.ATTENDEE_BADGE, c.COMPLETED_STATUS)]:
+        session.add(Attendee(first_name='Test', last_name='Sponsor', badge_type=badge_type, badge_status=badge_status))
+    session.commit()
+
+    matrix = badge_status_matrix(session, [c.SPONSOR_BADGE, c.SHINY_BADGE])
+    assert set(matrix) == {c.SPONSOR_BADGE, c.SHINY_BADGE}
+    assert list(matrix[c.SPONSOR_BADGE]) == [desc for val, desc in c.BADGE_STATUS_OPTS]
+    assert matrix[c.SPONSOR_BADGE][c.BADGE_STATUS[c.COMPLETED_STATUS]] == 2
+    assert matrix[c.SPONSOR_BADGE][c.BADGE_STATUS[c.REFUNDED_STATUS]] == 1
+    assert matrix[c.SHINY_BADGE][c.BADGE_STATUS[c.NEW_STATUS]] == 1
+    assert sum(matrix[c.SHINY_BADGE].values()) == 1
+
+
+def registrations_from_live_query(session):
+    # What the attendance graph showed when it aggregated the attendee table on every page load
+    graph_data = RegistrationDataOneYear()
+    graph_data.end_date = c.DATES['ESCHATON'].replace(hour=0, minute=0, second=0, microsecond=0, tzinfo=None)
+    graph_data.set_registrations_per_day(count_registrations_per_day(session).items())
+    return graph_data.registrations_per_day, graph_data.registrations_per_day_cumulative_sum
+
+
+def registrations_from_rollup(session):
+    graph_data = RegistrationDataOneYear()
+    graph_data.query_current_year(session)
+    return graph_data.registrations_per_day, graph_data.registrations_per_day_cumulative_sum
+
+
+@pytest.fixture
+def registrations(session):
+    eschaton = c.DATES['ESCHATON']
+    for i in range(200):
+        session.add(Attendee(first_name='Registered', last_name=str(i),
+                             registered=eschaton - timedelta(days=i % 90 * 3 + 1, hours=i % 24),
+                             badge_status=c.COMPLETED_STATUS if i % 5 else c.NEW_STATUS,
+                             paid=c.HAS_PAID if i % 5 else c.NOT_PAID))
+    session.commit()
+
+
+def test_daily_registration_backfill_matches_live_query(session, registrations):
+    rebuild_daily_registrations(session)
+    session.commit()
+    assert registrations_from_rollup(session) == registrations_from_live_query(session)
+
+
+def test_daily_registrations_update_incrementally(session, registrations, monkeypatch):
+    rebuild_daily_registrations(session)
+    session.commit()
+
+    queued_days = []
+    monkeypatch.setattr(tasks.update_daily_registrations, 'delay', queued_days.append)
+
+    refunded = session.query(Attendee).filter(Attendee.badge_status == c.COMPLETED_STATUS).first()
+    refunded.badge_status = c.REFUNDED_STATUS
+    completed = session.query(Attendee).filter(Attendee.badge_status == c.NEW_STATUS).first()
+    completed.badge_status = c.COMPLETED_STATUS
+    session.commit()
+
+    assert queued_days
+    for days in queued_days:
+        tasks.update_daily_registrations(days)
+
+    session.expire_all()
+    assert registrations_from_rollup(session) == registrations_from_live_query(session)
+
+
+def test_daily_registrations_follow_deleted_attendees(session, registrations, monkeypatch):
+    rebuild_daily_registrations(session)
+    session.commit()
+
+    queued_days = []
+    monkeypatch.setattr(tasks.update_daily_registrations, 'delay', queued_days.append)
+
+    for attendee in session.query(Attendee).filter(Attendee.badge_status == c.COMPLETED_STATUS).limit(10):
+        session.delete(attendee)
+    session.commit()
+
+    assert queued_days
+    for days in queued_days:
+        tasks.update_daily_registrations(days)
+
+    session.expire_all()
+    assert registrations_from_rollup(session) == registrations_from_live_query(session)
+
+
+def test_daily_registration_refresh_is_idempotent(session, registrations):
+    # Refreshing a day that another task already inserted updates it instead of violating the unique day
+    days = sorted(count_registrations_per_day(session))[:3]
+    refresh_daily_registrations(session, days)
+    refresh_daily_registrations(session, days)
+    session.commit()
+
+    assert session.query(DailyRegistrationCount).count() == 3
+    rebuild_daily_registrations(session)
+    session.commit()
+    assert registrations_from_rollup(session) == registrations_from_live_query(session)
+
+
+def test_badge_inventory_invalidated_after_commit(session, monkeypatch):
+    invalidations = []
+    monkeypatch.setattr(badge_inventory, 'invalidate', lambda: invalidations.append(True))
+    upgrade_type = next(iter(c.BADGE_TYPE_PRICES))
+
+    session.add(Attendee(first_name='Rolled', last_name='Back', badge_type=upgrade_type,
+                         badge_status=c.COMPLETED_STATUS))
+    session.flush()
+    session.rollback()
+    assert invalidations == []
+
+    session.add(Attendee(first_name='Upgraded', last_name='Sponsor', badge_type=upgrade_type,
+                         badge_status=c.COMPLETED_STATUS))
+    session.flush()
+    assert invalidations == []
+    session.commit()
+    assert invalidations == [True]
+
+
+def test_badge_inventory_ignores_counts_raced_by_invalidation(monkeypatch):
+    upgrade_type = next(iter(c.BADGE_TYPE_PRICES))
+    results = iter([{upgrade_type: 1}, {upgrade_type: 2}])
+
+    def query_counts():
+        counts = next(results)
+        if counts[upgrade_type] == 1:
+            badge_inventory.invalidate()  # A commit lands while the first count is running
+        return counts
+
+    badge_inventory.invalidate()
+    monkeypatch.setattr(badge_inventory, '_query_counts', query_counts)
+    assert badge_inventory.count(upgrade_type) == 1
+    assert badge_inventory.count(upgrade_type) == 2
+    badge_inventory.invalidate()
+
+
+def test_badge_count_for_types_without_inventory(session):
+    session.add(Attendee(first_name='Plain', last_name='Attendee', badge_type=c.ATTENDEE_BADGE,
+                         badge_status=c.COMPLETED_STATUS))
+    session.commit()
+    if c.ATTENDEE_BADGE not in c.BADGE_TYPE_PRICES:
+        assert c.get_badge_count_by_type(c.ATTENDEE_BADGE) == 1
+
+
+def test_registration_history_round_trip(tmp_path, monkeypatch):
+    monkeypatch.setattr(mff_reports, 'registration_history_dir', lambda: str(tmp_path))
+    year_data = RegistrationDataOneYear()
+    year_data.end_date = c.DATES['ESCHATON'] - timedelta(days=365)
+    year_data.registrations_per_day = [0] * 360 + [5, 70000, 0, 3, 1]
+    year_data.save_to_history_file()
+
+    previous_year, = previous_years_registrations()
+    assert previous_year.registrations_per_day == year_data.registrations_per_day
+    assert previous_year.registrations_per_day_cumulative_sum[-1] == 70009
+    assert previous_year.event_name.endswith(str(year_data.end_date.year))
+
+
+def test_on_sale_hours_match_registration_times(session, registrations):
+    mff_reports.on_sale_hours_cache.clear()
+    graph_data = RegistrationDataOneYear()
+    graph_data.query_on_sale_hours(session, c.DATES['ESCHATON'] - timedelta(days=30, minutes=30), num_hours=30 * 24)
+
+    # The first hour is a whole hour, not whatever was left of it when registration opened
+    start = (c.DATES['ESCHATON'] - timedelta(days=30, minutes=30)).replace(minute=0, second=0, microsecond=0)
+    assert graph_data.on_sale_start == start.astimezone(UTC).replace(tzinfo=None)
+
+    expected = [0] * (30 * 24)
+    for attendee in session.query(Attendee).filter(Attendee.badge_status == c.COMPLETED_STATUS):
+        if start <= attendee.registered < c.DATES['ESCHATON']:
+            expected[int((attendee.registered - start).total_seconds() // 3600)] += 1
+    assert graph_data.registrations_per_hour == expected
+
+    # Later page loads reuse the counts instead of grouping the attendee table again
+    session.add(Attendee(first_name='Late', last_name='Registration', registered=start + timedelta(minutes=5),
+                         badge_status=c.COMPLETED_STATUS, paid=c.HAS_PAID))
+    session.commit()
+    graph_data.query_on_sale_hours(session, start, num_hours=30 * 24)
+    assert graph_data.registrations_per_hour == expected
+    mff_reports.on_sale_hours_cache.clear()
+
+
+def test_projected_total_uses_rolling_average():
+    year_data = RegistrationDataOneYear()
+    year_data.end_date = c.DATES['ESCHATON'].replace(tzinfo=None)
+    year_data.registrations_per_day = [0] * 340 + [100] + [7] * 14 + [0] * 10
+    year_data.compute_cumulative_sum_from_registrations_per_day()
+
+    today = year_data.end_date.date() - timedelta(days=10)
+    assert year_data.rolling_average_per_day()[354] == 7
+    assert year_data.projected_total(today) == 100 + 7 * 14 + 7 * 10
+    assert year_data.projected_total(year_data.end_date.date()) == 198
+
+
+@pytest.fixture
+def velocity(session, monkeypatch):
+    monkeypatch.setattr(c, 'REGISTRATION_VELOCITY_MINUTES', 30)
+    monkeypatch.setattr(c, 'REGISTRATION_VELOCITY_RESYNC_SECONDS', 3600)
+    now = localized_now().replace(second=30)
+    for i in range(40):
+        session.add(Attendee(first_name='Velocity', last_name=str(i), registered=now - timedelta(minutes=i),
+                             badge_status=c.COMPLETED_STATUS, paid=c.HAS_PAID))
+    session.commit()
+    return RegistrationVelocity(), now
+
+
+def test_registration_velocity_cold_load(velocity):
+    registration_velocity, now = velocity
+    per_minute = registration_velocity.per_minute(now)
+    assert per_minute[None] == [1] * 30
+
+
+def test_registration_velocity_ring_buffer_wraps(velocity):
+    registration_velocity, now = velocity
+    registration_velocity.per_minute(now)
+
+    registration_velocity.record(when=now)
+    registration_velocity.record(when=now + timedelta(minutes=5))
+    registration_velocity.record(when=now - timedelta(minutes=45))  # already outside of the window
+
+    per_minute = registration_velocity.per_minute(now + timedelta(minutes=5))
+    assert len(per_minute[None]) == 30
+    assert per_minute[None][-6:] == [2, 0, 0, 0, 0, 1]
+    assert sum(per_minute[None]) == 24 + 2 + 1
+
+    per_minute = registration_velocity.per_minute(now + timedelta(minutes=45))
+    assert per_minute[None] == [0] * 30
+
+
+def test_registration_velocity_records_on_commit(session, velocity, monkeypatch):
+    registration_velocity, now = velocity
+    monkeypatch.setattr('mff_rams_plugin.models.registration_velocity', registration_velocity)
+    registration_velocity.per_minute(now)
+
+    session.add(Attendee(first_name='Rolled', last_name='Back', registered=now - timedelta(minutes=3),
+                         badge_status=c.COMPLETED_STATUS, paid=c.HAS_PAID))
+    session.flush()
+    session.rollback()
+    assert registration_velocity.per_minute(now)[None] == [1] * 30
+
+    session.add(Attendee(first_name='Committed', last_name='Late', registered=now - timedelta(minutes=3),
+                         badge_status=c.COMPLETED_STATUS, paid=c.HAS_PAID))
+    session.commit()
+    assert registration_velocity.per_minute(now)[None][-4:] == [2, 1, 1, 1]
+
+
+@pytest.fixture
+def comped_attendees(session):
+    for i in range(23):
+        session.add(Attendee(first_name='Comped', last_name='Smith' if i % 3 else 'Jones',
+                             paid=c.NEED_NOT_PAY, placeholder=bool(i % 4 == 0), comped_reason=f'Reason {i}'))
+    session.add(Attendee(first_name='Paying', last_name='Smith', paid=c.HAS_PAID))
+    session.commit()
+
+
+def test_comped_badge_counts(session, comped_attendees):
+    all_comped = session.valid_attendees().filter(Attendee.paid == c.NEED_NOT_PAY)
+    assert comped_badge_counts(session) == {
+        'all_comped': all_comped.count(),
+        'claimed_comped': all_comped.filter(Attendee.placeholder == False).count(),  # noqa: E712
+        'unclaimed_comped': all_comped.filter(Attendee.placeholder == True).count(),  # noqa: E712
+    }
+
+
+@pytest.mark.parametrize('sort', ['name', 'badge_type', 'badge_num', 'claimed'])
+def test_comped_badges_keyset_pages(session, comped_attendees, sort):
+    pages, after, has_next = [], None, True
+    while has_next:
+        attendees, has_previous, has_next = comped_badges_page(session, sort=sort, after=after, page_size=5)
+        assert has_previous == bool(pages)
+        pages.append([a.id for a in attendees])
+        after = attendees[-1].id
+
+    seen = [id for page in pages for id in page]
+    assert len(seen) == len(set(seen)) == comped_badge_counts(session)['all_comped']
+
+    # Walking back from the last page visits the same pages
+    attendees, has_previous, has_next = comped_badges_page(session, sort=sort, before=pages[-1][0], page_size=5)
+    assert [a.id for a in attendees] == pages[-2]
+    assert has_next and has_previous == (len(pages) > 2)
+
+
+def test_comped_badges_search_and_filter(session, comped_attendees):
+    attendees, _, _ = comped_badges_page(session, show='unclaimed', search='jones')
+    assert attendees and all(a.placeholder and a.last_name == 'Jones' for a in attendees)
+
+
+@pytest.fixture
+def accessibility_requests(session):
+    services = [service for service, label in c.ACCESSIBILITY_SERVICE_OPTS]
+    for i in range(30):
+        requested = services[i % len(services):i % len(services) + i % 3]
+        session.add(Attendee(first_name='Accessible', last_name=str(i), badge_printed_name=f'Badge {i}',
+                             email=f'access{i}@example.com', accessibility_requests=','.join(map(str, requested)),
+                             other_accessibility_requests='Something else' if c.OTHER in requested else ''))
+    # Stored out of label order, e.g. by an import
+    session.add(Attendee(first_name='Accessible', last_name='Reversed', badge_printed_name='Badge Reversed',
+                         email='reversed@example.com', accessibility_requests=','.join(map(str, services[::-1]))))
+    session.commit()
+
+
+def test_accessibility_request_rows_match_attendee_labels(session, accessibility_requests):
+    expected = [(a.badge_printed_name, a.badge_num, a.email, ", ".join(a.accessibility_requests_labels),
+                 a.other_accessibility_requests)
+                for a in session.query(Attendee).filter(Attendee.accessibility_requests != '')]
+    assert expected
+    assert sorted(accessibility_request_rows(session)) == sorted(expected)
+
+
+def test_accessibility_service_counts(session, accessibility_requests):
+    counts = accessibility_service_counts(session)
+    for service, label in c.ACCESSIBILITY_SERVICE_OPTS:
+        assert counts[label] == len([a for a in session.valid_attendees() if service in a.accessibility_requests_ints])
+
+
+def accessibility_request_pairs(session):
+    return sorted(session.query(AttendeeAccessibilityRequest.attendee_id, AttendeeAccessibilityRequest.service))
+
+
+def test_accessibility_request_rows_follow_attendee(session, accessibility_requests):
+    expected = sorted((a.id, service) for a in session.query(Attendee) for service in a.accessibility_requests_ints)
+    assert accessibility_request_pairs(session) == expected
+
+    attendee = session.query(Attendee).filter(has_accessibility_request_rows(c.ASL)).first()
+    attendee.accessibility_requests = str(c.SEATING)
+    session.commit()
+    assert session.query(AttendeeAccessibilityRequest.service).filter_by(attendee_id=attendee.id).all() == [
+        (c.SEATING,)]
+
+    attendee.accessibility_requests = ''
+    session.commit()
+    assert not session.query(Attendee).filter(has_accessibility_request_rows(), Attendee.id == attendee.id).count()
+
+    synced = accessibility_request_pairs(session)
+    assert rebuild_accessibility_request_rows(session) == len(synced)
+    assert accessibility_request_pairs(session) == synced
+
+
+def test_has_accessibility_request_rows(session, accessibility_requests):
+    for service, label in c.ACCESSIBILITY_SERVICE_OPTS:
+        filtered = {a.id for a in session.query(Attendee).filter(has_accessibility_request_rows(service))}
+        assert filtered == {a.id for a in session.query(Attendee) if service in a.accessibility_requests_ints}
+
+
+@pytest.fixture
+def approved_dealers(session):
+    now = localized_now()
+    for i in range(20):
+        session.add(Group(name=f'Approved Dealer {i}', tables=1, is_dealer=True, cost=100,
+                          status=c.APPROVED if i % 4 else c.SHARED, amount_paid=10000 if i % 5 == 0 else 0,
+                          approved=None if i == 1 else now - timedelta(days=c.DEALER_PAYMENT_DAYS + 10 - i)))
+    session.commit()
+
+
+def test_dealer_payment_is_late_expression_matches_python(session, approved_dealers):
+    in_sql = {g.id for g in session.query(Group).filter(Group.dealer_payment_is_late == True)}  # noqa: E712
+    in_python = {g.id for g in session.query(Group) if g.dealer_payment_is_late}
+    assert in_sql and in_sql == in_python
+
+
+@pytest.mark.parametrize('signnow_folder', ['', 'dealer-folder'])
+def test_dealer_payment_due_follows_signed_terms(session, approved_dealers, monkeypatch, signnow_folder):
+    monkeypatch.setattr(c, 'SIGNNOW_DEALER_FOLDER_ID', signnow_folder)
+    now = localized_now()
+    groups = session.query(Group).filter(Group.approved != None).order_by(Group.name).all()  # noqa: E711
+    for i, group in enumerate(groups[::2]):
+        # Half sign late enough to push their payment out of the late window, half early enough to stay in it
+        signed = now - timedelta(days=c.DEALER_PAYMENT_DAYS + (5 if i % 2 else -5))
+        if i % 3 == 0:
+            # A re-signed document, saved first so the earliest one isn't simply the first row
+            session.add(SignedDocument(fk_id=group.id, model='Group', created=now))
+            session.flush()
+        session.add(SignedDocument(fk_id=group.id, model='Group', created=signed))
+    session.commit()
+    session.expire_all()
+
+    due_in_sql = {g.id for g in session.query(Group).filter(Group.dealer_payment_due != None)}  # noqa: E711
+    assert due_in_sql == {g.id for g in session.query(Group) if g.dealer_payment_due}
+
+    late_in_sql = {g.id for g in session.query(Group).filter(Group.dealer_payment_is_late == True)}  # noqa: E712
+    late_in_python = {g.id for g in session.query(Group) if g.dealer_payment_is_late}
+    assert late_in_sql == late_in_python
+    assert any(g.dealer_terms_signed for g in session.query(Group) if g.id in late_in_python)
+
+
+def test_late_dealer_groups(session, approved_dealers):
+    late = late_dealer_groups(session).all()
+    assert late and all(g.dealer_payment_is_late and g.amount_paid < g.cost * 100 for g in late)
+    assert [g.dealer_payment_due for g in late] == sorted(g.dealer_payment_due for g in late)
+
+    due_soon = late_dealer_groups(session, 7).all()
+    assert set(late) < set(due_soon)
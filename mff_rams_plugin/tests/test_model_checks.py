@@ -0,0 +1,43 @@
+import pytest
+
+from uber.config import c
+from uber.models import Group
+from mff_rams_plugin.model_checks import new_or_changed_fields, no_approval_without_power_fee
+
+POWER_FEE_FIELDS = ['status', 'auto_recalc', 'power', 'power_fee']
+
+
+@pytest.fixture
+def dealer_group(session):
+    group = Group(name='Power Dealer', tables=1, is_dealer=True, auto_recalc=True, status=c.UNAPPROVED)
+    session.add(group)
+    session.commit()
+    return group
+
+
+def test_unchanged_fields_are_skipped(session, dealer_group):
+    assert new_or_changed_fields(dealer_group, POWER_FEE_FIELDS) == []
+
+    dealer_group.status = c.APPROVED
+    assert new_or_changed_fields(dealer_group, POWER_FEE_FIELDS) == ['status']
+
+
+def test_changes_survive_autoflush(session, dealer_group):
+    dealer_group.status = c.APPROVED
+    dealer_group.power_fee = 0
+    session.flush()  # e.g., a query during validation autoflushes the edit
+
+    assert set(new_or_changed_fields(dealer_group, POWER_FEE_FIELDS)) == {'status', 'power_fee'}
+    if dealer_group.default_power_fee is None:
+        assert no_approval_without_power_fee(dealer_group)
+
+    session.commit()
+    assert new_or_changed_fields(dealer_group, POWER_FEE_FIELDS) == []
+
+
+def test_new_model_flushed_before_validation(session):
+    group = Group(name='Brand New Dealer', tables=1, is_dealer=True)
+    session.add(group)
+    session.flush()
+
+    assert new_or_changed_fields(group, POWER_FEE_FIELDS) == POWER_FEE_FIELDS
@@ -0,0 +1,111 @@
+from datetime import timedelta
+
+import pytest
+
+from uber.config import c
+from uber.models import Attendee, AttendeeAccount
+from mff_rams_plugin import tasks
+from mff_rams_plugin.config import PreregCartContext
+
+
+@pytest.fixture
+def queued_checks(monkeypatch):
+    calls = []
+    monkeypatch.setattr(tasks.check_pit_badges, 'delay', lambda account_ids: calls.append(account_ids))
+    return calls
+
+
+@pytest.fixture
+def accounts_with_minors(session):
+    minor_birthdate = c.EPOCH.date() - timedelta(days=365 * 12)
+    adult_birthdate = c.EPOCH.date() - timedelta(days=365 * 40)
+    accounts = []
+    for i in range(250):
+        account = AttendeeAccount(email=f'parent{i}@example.com')
+        account.attendees.append(Attendee(first_name='Parent', last_name=str(i), birthdate=adult_birthdate,
+                                          badge_type=c.PARENT_IN_TOW_BADGE, badge_status=c.COMPLETED_STATUS))
+        for j in range(4):
+            account.attendees.append(Attendee(first_name=f'Minor {j}', last_name=str(i), birthdate=minor_birthdate,
+                                              paid=c.HAS_PAID, badge_status=c.COMPLETED_STATUS))
+        session.add(account)
+        accounts.append(account)
+    session.commit()
+    return accounts
+
+
+def test_bulk_minor_status_change_queues_one_check(session, accounts_with_minors, queued_checks):
+    minors = session.query(Attendee).filter(Attendee.badge_type != c.PARENT_IN_TOW_BADGE).all()
+    assert len(minors) == 1000
+
+    for minor in minors:
+        minor.badge_status = c.REFUNDED_STATUS
+    session.commit()
+
+    queued_ids = [account_id for batch in queued_checks for account_id in batch]
+    assert len(queued_checks) == -(-len(accounts_with_minors) // tasks.AFTER_COMMIT_BATCH_SIZE)
+    assert sorted(queued_ids) == sorted(account.id for account in accounts_with_minors)
+
+    for batch in queued_checks:
+        tasks.check_pit_badges(batch)
+
+    session.expire_all()
+    pit_badges = session.query(Attendee).filter(Attendee.badge_type == c.PARENT_IN_TOW_BADGE).all()
+    assert all(badge.badge_status == c.INVALID_STATUS for badge in pit_badges)
+
+
+def test_rollback_discards_queued_checks(session, accounts_with_minors, queued_checks):
+    minor = session.query(Attendee).filter(Attendee.badge_type != c.PARENT_IN_TOW_BADGE).first()
+    minor.badge_status = c.REFUNDED_STATUS
+    session.flush()
+    session.rollback()
+    session.commit()
+    assert not queued_checks
+
+
+def test_pit_eligibility_cached_until_an_attendee_is_saved(session, accounts_with_minors):
+    account = accounts_with_minors[0]
+    eligibility = account.pit_eligibility
+    assert account.pit_eligibility is eligibility
+    assert account.pit_badge is not None
+
+    account.pit_badge.badge_status = c.INVALID_STATUS
+    session.flush()
+    assert account.pit_eligibility is not eligibility
+    assert account.pit_badge is None and account.pit_eligible
+
+
+def test_prereg_cart_context_waits_until_asked(session, monkeypatch):
+    context = PreregCartContext()
+    monkeypatch.setattr(type(c), 'PAGE_PATH', '/preregistration/form')
+    monkeypatch.setattr(type(c), 'PREREG_CART_CONTEXT', context)
+    computed = []
+    get_account_pit_status = PreregCartContext._get_account_pit_status
+    monkeypatch.setattr(PreregCartContext, '_get_account_pit_status',
+                        staticmethod(lambda account: computed.append(account) or get_account_pit_status(account)))
+
+    account = AttendeeAccount(email='lazy@example.com')
+    session.add(account)
+    session.commit()
+    context.set_account(account)
+    assert not computed
+    assert context.account_pit_status() == (False, False)
+
+    # Adding a paid minor later in the same request makes the account eligible
+    account.attendees.append(Attendee(first_name='Minor', last_name='Lazy', paid=c.HAS_PAID,
+                                      birthdate=c.EPOCH.date() - timedelta(days=365 * 12),
+                                      badge_status=c.COMPLETED_STATUS))
+    session.commit()
+    assert context.account_pit_status() == (True, False)
+    assert len(computed) == 2
+
+
+def test_new_account_and_minors_queue_one_check(session, queued_checks):
+    account = AttendeeAccount(email='new.parent@example.com')
+    for i in range(3):
+        account.attendees.append(Attendee(first_name=f'Minor {i}', last_name='New', paid=c.HAS_PAID,
+                                          birthdate=c.EPOCH.date() - timedelta(days=365 * 12),
+                                          badge_status=c.COMPLETED_STATUS))
+    session.add(account)
+    session.commit()
+
+    assert queued_checks == [[account.id]]
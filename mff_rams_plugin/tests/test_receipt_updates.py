@@ -0,0 +1,48 @@
+import pytest
+
+from uber.config import c
+from uber.models import Attendee
+from mff_rams_plugin import tasks
+
+
+@pytest.fixture
+def queued_receipt_updates(monkeypatch):
+    calls = []
+    monkeypatch.setattr(tasks.update_need_not_pay_receipts, 'delay', calls.append)
+    return calls
+
+
+@pytest.fixture
+def kid_in_tow(session):
+    attendee = Attendee(first_name='Kid', last_name='In Tow', badge_type=c.KID_IN_TOW_BADGE,
+                        badge_status=c.COMPLETED_STATUS)
+    session.add(attendee)
+    session.commit()
+    return attendee
+
+
+def test_resaving_need_not_pay_badge_queues_nothing(session, kid_in_tow, queued_receipt_updates):
+    for i in range(3):
+        kid_in_tow.admin_notes = f'Edit {i}'
+        session.commit()
+
+    kid_in_tow.badge_status = c.NOT_ATTENDING
+    session.commit()
+
+    assert kid_in_tow.paid == c.NEED_NOT_PAY
+    assert queued_receipt_updates == []
+
+
+def test_receipt_update_merged_per_transaction(session, queued_receipt_updates):
+    attendee = Attendee(first_name='Paid', last_name='Attendee', paid=c.HAS_PAID, badge_status=c.COMPLETED_STATUS)
+    session.add(attendee)
+    session.commit()
+
+    # Both adjustments change paid, and the attendee is flushed twice, but only one update is sent
+    attendee.badge_status = c.NOT_ATTENDING
+    attendee.badge_type = c.PARENT_IN_TOW_BADGE
+    session.flush()
+    attendee.admin_notes = 'Marked not attending'
+    session.commit()
+
+    assert queued_receipt_updates == [[attendee.id]]
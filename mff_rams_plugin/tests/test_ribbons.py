@@ -0,0 +1,72 @@
+import pytest
+
+from uber.config import c
+from uber.models import Attendee
+from uber.utils import add_opt, remove_opt
+from mff_rams_plugin.models import rebuild_ribbon_masks
+
+
+@pytest.fixture
+def ribboned_attendees(session):
+    attendees = [
+        Attendee(first_name='Panelist', last_name='Only', ribbon=str(c.PANELIST_RIBBON)),
+        Attendee(first_name='Staff', last_name='Only', ribbon=str(c.STAFF_RIBBON)),
+        Attendee(first_name='Staff', last_name='Dealer', ribbon=f'{c.STAFF_RIBBON},{c.DEALER_RIBBON}'),
+        Attendee(first_name='No', last_name='Ribbons'),
+    ]
+    session.add_all(attendees)
+    session.commit()
+    return attendees
+
+
+def test_ribbon_mask_follows_ribbon(session, ribboned_attendees):
+    panelist = ribboned_attendees[0]
+    assert panelist.has_ribbon(c.PANELIST_RIBBON) and not panelist.has_ribbon(c.DEALER_RIBBON)
+
+    panelist.ribbon = add_opt(panelist.ribbon_ints, c.DEALER_RIBBON)
+    assert panelist.has_ribbon(c.DEALER_RIBBON)
+    panelist.ribbon = remove_opt(panelist.ribbon_ints, c.PANELIST_RIBBON)
+    session.commit()
+
+    session.expire_all()
+    assert not panelist.has_ribbon(c.PANELIST_RIBBON) and panelist.has_ribbon(c.DEALER_RIBBON)
+
+
+@pytest.mark.parametrize('ribbon', ['PANELIST_RIBBON', 'STAFF_RIBBON', 'DEALER_RIBBON', 'VOLUNTEER_RIBBON'])
+def test_has_ribbon_expression_matches_python(session, ribboned_attendees, ribbon):
+    ribbon = getattr(c, ribbon)
+    matched = {attendee.id for attendee in session.query(Attendee).filter(Attendee.has_ribbon(ribbon))}
+    assert matched == {attendee.id for attendee in session.query(Attendee) if ribbon in attendee.ribbon_ints}
+
+
+def test_has_ribbon_reads_ribbon_when_mask_is_stale(session, ribboned_attendees):
+    staff = ribboned_attendees[1]
+    session.query(Attendee).filter(Attendee.id == staff.id).update({Attendee.ribbon_mask: 0},
+                                                                    synchronize_session=False)
+    session.commit()
+
+    session.expire_all()
+    assert staff.has_ribbon(c.STAFF_RIBBON)
+
+
+def test_has_ribbon_expression_without_a_bit(session, ribboned_attendees, monkeypatch):
+    monkeypatch.setattr(c, 'RIBBON_MASK_BITS', {ribbon: bit for ribbon, bit in c.RIBBON_MASK_BITS.items()
+                                                if ribbon != c.DEALER_RIBBON})
+    matched = {attendee.id for attendee in session.query(Attendee).filter(Attendee.has_ribbon(c.DEALER_RIBBON))}
+    assert matched == {ribboned_attendees[2].id}
+
+
+def test_all_panelists(session, ribboned_attendees):
+    panelist, staff, staff_dealer, no_ribbons = ribboned_attendees
+    panelist_ids = {attendee.id for attendee in session.all_panelists()}
+    assert {panelist.id, staff.id} <= panelist_ids
+    assert not {staff_dealer.id, no_ribbons.id} & panelist_ids
+
+
+def test_rebuild_ribbon_masks(session, ribboned_attendees):
+    session.query(Attendee).update({Attendee.ribbon_mask: 0}, synchronize_session=False)
+    assert rebuild_ribbon_masks(session, batch_size=2) == session.query(Attendee).count()
+    session.commit()
+
+    session.expire_all()
+    assert all(attendee.has_ribbon(c.STAFF_RIBBON) for attendee in ribboned_attendees[1:3])